@@ -1,8 +1,7 @@
 import pygame
 from pathlib import Path
 from tileset import load_tileset, get_tile, get_animation_steps
-from PIL import Image
-import numpy as np
+from recording import GifWriter, tileset_palette
 import argparse
 
 RENDERING_GRID_WIDTH = 10
@@ -41,12 +40,16 @@ if __name__ == "__main__":
         screen = pygame.display.set_mode(window_size)
     else:
         screen = pygame.surface.Surface(window_size)
-        frames = []
+        palette = tileset_palette(
+            [s.tile.image for a in animations for s in a.animation],
+            background=BLACK,
+        )
+        gif = GifWriter(args.output, palette, duration=1_000/FRAME_RATE)
     clock = pygame.time.Clock()
     dt = 0
 
     if args.generate_gif:
-        print("recording frames... ", end='')
+        print("recording frames... ", end='', flush=True)
 
     t = 0
     running = True
@@ -76,7 +79,7 @@ if __name__ == "__main__":
             )
 
         if args.generate_gif:
-            frames.append(np.transpose(pygame.surfarray.array3d(screen), (1, 0, 2)))
+            gif.write(screen)
             if t >= ANIMATION_SEQUENCE_LEN * ANIMATION_INV_SPEED:
                 break
         else:
@@ -85,16 +88,7 @@ if __name__ == "__main__":
         t += 1
 
     if args.generate_gif:
-        print("done")
-        print("generating GIF... ", end='', flush=True)
-        imgs = [Image.fromarray(img) for img in frames]
-        imgs[0].save(
-            args.output,
-            save_all=True,
-            append_images=imgs[1:],
-            duration=1_000/FRAME_RATE,
-            loop=0,
-        )
+        gif.close()
         print("done")
         print(f"GIF written in {args.output}")
 
@@ -1,10 +1,13 @@
 import pygame
 from pathlib import Path
-from tileset import load_tileset
-from PIL import Image
-import numpy as np
+from tileset import load_tileset, CharacterAtlas, Characters
+from recording import GifWriter, tileset_palette
 import argparse
 import os
+import math
+from functools import partial
+from multiprocessing import Pool
+from typing import List, Dict, Tuple
 
 RENDERING_GRID_WIDTH = 8
 RENDERING_TILE_SIZE = 128
@@ -22,10 +25,28 @@ BLACK = (0, 0, 0)
 ANIMATION_INV_SPEED = 15
 
 
+def sprites(name: str, animations: Dict[str, List[int]], t: int):
+    return [
+        (
+            name,
+            k,
+            t // ANIMATION_INV_SPEED,
+            (
+                (i % RENDERING_GRID_WIDTH) * RENDERING_TILE_SIZE,
+                (i // RENDERING_GRID_WIDTH) * RENDERING_TILE_SIZE,
+            ),
+        )
+        for i, k in enumerate(animations)
+    ]
+
+
 def run(characters):
     pygame.init()
     screen = pygame.display.set_mode(CANVA_SIZE)
     clock = pygame.time.Clock()
+    atlas = CharacterAtlas(
+        characters, (RENDERING_TILE_SIZE, RENDERING_TILE_SIZE)
+    )
 
     curr = 0
     print(list(characters.keys())[curr])
@@ -48,17 +69,8 @@ def run(characters):
 
         screen.fill(BLACK)
 
-        for i, (k, v) in enumerate(characters[list(characters.keys())[curr]].items()):
-            screen.blit(
-                pygame.transform.scale(
-                    v[t // ANIMATION_INV_SPEED % len(v)],
-                    (RENDERING_TILE_SIZE, RENDERING_TILE_SIZE),
-                ),
-                (
-                    (i % RENDERING_GRID_WIDTH) * RENDERING_TILE_SIZE,
-                    (i // RENDERING_GRID_WIDTH) * RENDERING_TILE_SIZE,
-                ),
-            )
+        name = list(characters.keys())[curr]
+        atlas.blits(screen, sprites(name, characters.animations[name], t))
 
         pygame.display.flip()
         clock.tick(FRAME_RATE)
@@ -67,52 +79,101 @@ def run(characters):
     pygame.quit()
 
 
-def generate_gif(characters, output_dir: str):
+# number of frames after which all the animations of a character loop
+# together
+def loop_length(animations: Dict[str, List[int]]) -> int:
+    return math.lcm(*map(len, animations.values()))
+
+
+# the steps of the loop of the animations of a character, as (first step,
+# frames of the sheet in each slot of the grid, number of steps), identical
+# consecutive steps being merged, the loop being rotated so that the last
+# steps are merged with the first ones when they are the same
+def loop_steps(
+    animations: Dict[str, List[int]]
+) -> List[Tuple[int, Tuple[int, ...], int]]:
+    steps = []
+    for step in range(loop_length(animations)):
+        key = tuple(ids[step % len(ids)] for ids in animations.values())
+        if len(steps) > 0 and steps[-1][1] == key:
+            start, _, n = steps[-1]
+            steps[-1] = (start, key, n + 1)
+        else:
+            steps.append((step, key, 1))
+
+    if len(steps) > 1 and steps[0][1] == steps[-1][1]:
+        start, key, n = steps.pop()
+        steps[0] = (start, key, n + steps[0][2])
+    return steps
+
+
+def generate_character_gif(characters: Characters, name: str, output_dir: str) -> str:
     screen = pygame.surface.Surface(CANVA_SIZE)
+    character = Characters(
+        {name: characters.sheets[name]}, {name: characters.animations[name]}
+    )
+    atlas = CharacterAtlas(
+        character, (RENDERING_TILE_SIZE, RENDERING_TILE_SIZE)
+    )
+    palette = tileset_palette([character.sheets[name].image], background=BLACK)
+
+    animations = character.animations[name]
+    output = f"{output_dir}/{name}.gif"
+    size = (RENDERING_TILE_SIZE, RENDERING_TILE_SIZE)
+    positions = [(x, y) for *_, (x, y) in sprites(name, animations, 0)]
+
+    # every frame of the sheet drawn once on the background, so that the
+    # slots are drawn again with plain copies instead of blending the sprites
+    frames = {}
+
+    def frame(animation: str, step: int) -> pygame.surface.Surface:
+        id = animations[animation][step % len(animations[animation])]
+        if id not in frames:
+            frames[id] = pygame.surface.Surface(size)
+            frames[id].fill(BLACK)
+            atlas.blits(frames[id], [(name, animation, step, (0, 0))])
+        return frames[id]
+
+    # frames only change every ANIMATION_INV_SPEED ticks, so only the steps of
+    # the loop are rendered, each one lasting as long as the ticks it stands
+    # for, and only the slots of the grid whose frame changed are drawn again
+    duration = ANIMATION_INV_SPEED * 1_000 / FRAME_RATE
+    screen.fill(BLACK)
+    previous = None
+    with GifWriter(output, palette, duration=duration) as gif:
+        for start, key, n in loop_steps(animations):
+            screen.blits(
+                [
+                    (frame(animation, start), positions[k])
+                    for k, animation in enumerate(animations)
+                    if previous is None or previous[k] != key[k]
+                ],
+                doreturn=False,
+            )
+            gif.write(screen, duration=n * duration)
+            previous = key
 
+    return output
+
+
+def generate_gif(characters: Characters, output_dir: str, jobs: int | None = None):
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    for name, character in characters.items():
-        frames = []
-        print(f"recording frames for {name}... ", end='', flush=True)
-
-        for t in range(100):
-            screen.fill(BLACK)
-
-            for i, (k, v) in enumerate(character.items()):
-                screen.blit(
-                    pygame.transform.scale(
-                        v[t // ANIMATION_INV_SPEED % len(v)],
-                        (RENDERING_TILE_SIZE, RENDERING_TILE_SIZE),
-                    ),
-                    (
-                        (i % RENDERING_GRID_WIDTH) * RENDERING_TILE_SIZE,
-                        (i // RENDERING_GRID_WIDTH) * RENDERING_TILE_SIZE,
-                    ),
-                )
-
-            frames.append(np.transpose(pygame.surfarray.array3d(screen), (1, 0, 2)))
-
-        print("done")
-        print("generating GIF... ", end='', flush=True)
-        imgs = [Image.fromarray(img) for img in frames]
-        output = f"{output_dir}/{name}.gif"
-        imgs[0].save(
-            output,
-            save_all=True,
-            append_images=imgs[1:],
-            duration=1_000/FRAME_RATE,
-            loop=0,
-        )
-        print("done")
-        print(f"GIF written in {output}")
+    print(f"recording frames for {len(characters)} characters...")
+    with Pool(jobs) as pool:
+        for output in pool.imap_unordered(
+            partial(generate_character_gif, characters, output_dir=output_dir),
+            characters.keys(),
+        ):
+            print(f"GIF written in {output}")
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--generate-gif", "-g", action="store_true")
     parser.add_argument("--output-dir", "-o", type=str, default="out/")
+    parser.add_argument("--jobs", "-j", type=int)
     args = parser.parse_args()
 
     _, _, characters = load_tileset(Path("../../punyworld.json"))
@@ -120,4 +181,4 @@ if __name__ == "__main__":
     if not args.generate_gif:
         run(characters)
     else:
-        generate_gif(characters, args.output_dir)
+        generate_gif(characters, args.output_dir, jobs=args.jobs)
@@ -1,6 +1,6 @@
 import pygame
 from pathlib import Path
-from tileset import load_tileset, compute_neighbours
+from tileset import load_tileset, Compatibility
 
 GRID_SIZE = 128
 
@@ -15,6 +15,8 @@ TILESET_PATH = "../../punyworld.json"
 
 if __name__ == "__main__":
     tiles, _, _ = load_tileset(Path(TILESET_PATH))
+    compatibility = Compatibility.from_tiles(tiles)
+    names = compatibility.names
 
     # "show indices"
     t, n, e, s, w = (0, 0, 0, 0, 0)
@@ -26,8 +28,8 @@ if __name__ == "__main__":
 
     running = True
     while running:
-        # compute its neighbours
-        tile = compute_neighbours(tiles[list(tiles.keys())[t]], tiles)
+        # its neighbours
+        tile = compatibility.neighbours[t]
         for event in pygame.event.get():
             if event.type == pygame.QUIT or (
                 event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE
@@ -65,20 +67,20 @@ if __name__ == "__main__":
                             e = (e + 1) % len(tile.e)
                 elif event.key == pygame.K_SPACE:
                     if event.mod & pygame.KMOD_LSHIFT:
-                        t = (t - 1) % len(tiles.keys())
+                        t = (t - 1) % len(names)
                         n, e, s, w = (0, 0, 0, 0)
-                        print(list(tiles.keys())[t])
+                        print(names[t])
                     else:
-                        t = (t + 1) % len(tiles.keys())
+                        t = (t + 1) % len(names)
                         n, e, s, w = (0, 0, 0, 0)
-                        print(list(tiles.keys())[t])
+                        print(names[t])
 
         screen.fill(BLACK)
 
         # show the tile and its neighbours
         width, height = screen.get_size()
         screen.blit(
-            pygame.transform.scale(tiles[list(tiles.keys())[t]].image, (GRID_SIZE, GRID_SIZE)),
+            pygame.transform.scale(tiles[names[t]].image, (GRID_SIZE, GRID_SIZE)),
             (GRID_SIZE, GRID_SIZE),
         )
         if len(tile.n) > 0:
@@ -0,0 +1,132 @@
+import math
+import random
+from abc import ABC, abstractmethod
+import numpy as np
+from typing import List, TypedDict
+from perlin_noise import PerlinNoise
+
+
+class NoiseOctave(TypedDict):
+    amplitude: float
+    octaves: float
+
+
+# a weighted sum of Perlin noise layers, one per NoiseOctave, evaluated on
+# whole grids of coordinates
+#
+# `seed` is shared by all the layers, and each layer draws its own random seed
+# when it's not given, as `perlin_noise.PerlinNoise` does
+class NoiseBackend(ABC):
+    def __init__(self, layers: List[NoiseOctave], seed: int | None = None):
+        self.layers = layers
+        self.seed = seed
+
+    # the (len(x), len(y)) values of the noise at (x[i], y[j], z)
+    @abstractmethod
+    def grid(self, x: np.ndarray, y: np.ndarray, z: float = 0.0) -> np.ndarray:
+        ...
+
+
+# the reference implementation, with `perlin_noise` evaluated once per sample
+# and per layer
+class PythonNoise(NoiseBackend):
+    def __init__(self, layers: List[NoiseOctave], seed: int | None = None):
+        super().__init__(layers, seed)
+        self.noise = [
+            (n["amplitude"], PerlinNoise(octaves=n["octaves"], seed=seed))
+            for n in layers
+        ]
+
+    def grid(self, x: np.ndarray, y: np.ndarray, z: float = 0.0) -> np.ndarray:
+        return np.array([
+            [sum(weight * n([i, j, z]) for weight, n in self.noise) for j in y]
+            for i in x
+        ])
+
+
+def fade(t: np.ndarray) -> np.ndarray:
+    return t * t * t * (t * (t * 6 - 15) + 10)
+
+
+# the same noise as PythonNoise, computed with NumPy for all the samples and
+# all the layers at once
+#
+# the gradient of a lattice point only depends on `seed * hash(point)`, it's
+# drawn with `random` exactly as `perlin_noise` does, so that both backends give
+# the same values for the same seed, and cached in an array indexed by the hash
+# of the point, which only grows with the distance to the origin
+class NumpyNoise(NoiseBackend):
+    def __init__(self, layers: List[NoiseOctave], seed: int | None = None):
+        super().__init__(layers, seed)
+        self.amplitudes = np.array([n["amplitude"] for n in layers], dtype=float)
+        self.octaves = np.array([n["octaves"] for n in layers], dtype=float)
+        self.seeds = [
+            seed if seed else random.randint(1, 10**5) for _ in layers
+        ]
+        # the gradients of each layer, by hash, and which of them are drawn
+        self.gradients = [np.zeros((0, 3)) for _ in layers]
+        self.drawn = [np.zeros(0, dtype=bool) for _ in layers]
+
+    # the (..., 3) gradients of a layer at the given hashes
+    def _gradients(self, layer: int, hashes: np.ndarray) -> np.ndarray:
+        size = int(hashes.max()) + 1
+        if size > len(self.drawn[layer]):
+            size = max(size, 2 * len(self.drawn[layer]))
+            gradients = np.zeros((size, 3))
+            gradients[:len(self.gradients[layer])] = self.gradients[layer]
+            drawn = np.zeros(size, dtype=bool)
+            drawn[:len(self.drawn[layer])] = self.drawn[layer]
+            self.gradients[layer], self.drawn[layer] = gradients, drawn
+
+        gradients, drawn = self.gradients[layer], self.drawn[layer]
+        missing = hashes[~drawn[hashes]]
+        if len(missing) > 0:
+            state = random.getstate()
+            for h in np.unique(missing).tolist():
+                random.seed(self.seeds[layer] * h)
+                gradients[h] = [random.uniform(-1, 1) for _ in range(3)]
+            random.setstate(state)
+            drawn[missing] = True
+
+        return gradients[hashes]
+
+    def grid(self, x: np.ndarray, y: np.ndarray, z: float = 0.0) -> np.ndarray:
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        values = np.zeros((len(x), len(y)))
+
+        # the grid is separable, so the corners, the offsets to them and their
+        # weights are only computed along each axis, and broadcast when combined
+        for layer, octaves in enumerate(self.octaves.tolist()):
+            px, py, pz = x * octaves, y * octaves, z * octaves
+            xs = [(c, px - c) for c in (np.floor(px), np.floor(px + 1))]
+            ys = [(c, py - c) for c in (np.floor(py), np.floor(py + 1))]
+            zs = [(c, pz - c) for c in (math.floor(pz), math.floor(pz + 1))]
+
+            for cx, dx in xs:
+                for cy, dy in ys:
+                    for cz, dz in zs:
+                        weight = np.outer(
+                            fade(1 - np.abs(dx)), fade(1 - np.abs(dy))
+                        ) * (self.amplitudes[layer] * fade(1 - abs(dz)))
+
+                        hashes = np.maximum(
+                            1,
+                            np.abs(
+                                cx[:, None] + 10 * cy[None, :] + 100 * cz + 1
+                            ).astype(np.int64),
+                        )
+                        g = self._gradients(layer, hashes)
+
+                        values += weight * (
+                            g[..., 0] * dx[:, None]
+                            + g[..., 1] * dy[None, :]
+                            + g[..., 2] * dz
+                        )
+
+        return values
+
+
+NOISE_BACKENDS = {
+    "python": PythonNoise,
+    "numpy": NumpyNoise,
+}
@@ -1,17 +1,31 @@
-from perlin_noise import PerlinNoise
-from typing import List, Any, Dict, Tuple, TypedDict
+from typing import List, Any, Callable, Dict, Set, Tuple, TypedDict
 import pygame
 import argparse
 from dataclasses import dataclass
 import rich
-from time import time_ns
+from time import time_ns, perf_counter_ns
+from collections import deque, OrderedDict
+import heapq
+import math
 import json
-from tileset import load_tileset, Tile, Name, get_animation_steps, Animation
+from tileset import (
+    load_tileset,
+    minimap,
+    Sheet,
+    Tile,
+    TileTable,
+    Animation,
+    AnimationStep,
+)
+from tilemap import (
+    write_map, write_chunked_map, CHUNKED_MAP_SUFFIX, FIRST_GID
+)
+from noise_backends import NoiseBackend, NoiseOctave, NOISE_BACKENDS
+from recording import ScreenshotWriter
 from pathlib import Path
 from enum import Enum
 from random import choice
 import numpy as np
-from PIL import Image
 
 BLACK = (0, 0, 0)
 GREY = (100, 100, 100)
@@ -21,6 +35,42 @@ ANIMATION_SEQUENCE_LEN = 4
 ANIMATION_INV_SPEED = 5
 
 CHUNK_SIZE = 8
+# number of tiles per unit of noise, independent of the size of the chunks
+NOISE_SCALE = 8
+# size, in tiles, of the blocks in which noise is computed, much larger than a
+# chunk, the cost of a call to the noise backend hardly depending on its size
+NOISE_BLOCK_SIZE = 64
+# number of blocks of noise kept per field, the least recently used ones being
+# dropped first, chunks only ever needing the blocks around them
+NOISE_CACHE_BLOCKS = 256
+# weight of the last chunk in the moving average of chunk generation times
+CHUNK_TIME_SMOOTHING = 0.2
+# number of frames over which the speed of the camera is measured, and how far
+# ahead, in frames, its position is predicted to prefetch chunks
+PREFETCH_HISTORY = 30
+PREFETCH_HORIZON = 60
+# chunks around the view which are prefetched even when the camera is still
+PREFETCH_MARGIN = 1
+# sizes of the tiles on screen, in pixels, between which the mouse wheel zooms
+ZOOM_LEVELS = [1, 2, 3, 4, 6, 8, 12, 16, 24, 32, 48, 64, 96]
+# below this size, chunks are drawn from thumbnails with one pixel per tile
+# instead of one blit per tile, there being more than ten thousand tiles on a
+# large screen at 8 pixels per tile already
+LOD_TILE_SIZE = 12
+# number of chunks shown on the minimap on each side of the camera
+MINIMAP_RADIUS = 16
+MAP_LAYERS = ["background", "foreground"]
+
+PROFILER_SECTIONS = ["events", "chunks", "world", "debug", "flip"]
+PROFILER_HISTORY = 240
+PROFILER_GRAPH_HEIGHT = 80
+PROFILER_COLORS = {
+    "events": (86, 180, 233),
+    "chunks": (230, 159, 0),
+    "world": (0, 158, 115),
+    "debug": (204, 121, 167),
+    "flip": (240, 228, 66),
+}
 
 
 def info(msg: str, end: str = '\n'):
@@ -31,11 +81,6 @@ def warning(msg: str, end: str = '\n'):
     rich.print(f"[bold yellow]WARNING[/bold yellow]: {msg}", end=end)
 
 
-class NoiseOctave(TypedDict):
-    amplitude: float
-    octaves: float
-
-
 class LandType(Enum):
     ROCK = 'r'
     GRASS = 'g'
@@ -48,13 +93,33 @@ class LandHeights(TypedDict):
     WATER: float
 
 
-def to_land_type(x: float, land_heights: LandHeights) -> LandType:
+LAND_TYPES = list(LandType)
+
+
+# land type of each noise value, as its index in LAND_TYPES, or -1 when there
+# is none
+def to_land_type(x: np.ndarray, land_heights: LandHeights) -> np.ndarray:
+    land = np.full(x.shape, -1)
     for k, v in land_heights.items():
-        if x > v:
-            return LandType._member_map_[k]
+        land[(land == -1) & (x > v)] = LAND_TYPES.index(LandType._member_map_[k])
+    return land
+
 
+# base-3 code of the land types of the 4 corners of a tile, e.g. "gggw"
+def land_code(key: str) -> int:
+    code = 0
+    for c in key:
+        code = code * len(LAND_TYPES) + LAND_TYPES.index(LandType(c))
+    return code
 
-@dataclass
+
+# 9-bit mask of a 3x3 neighbourhood of forest tiles, e.g. "101110010"
+def forest_code(key: str) -> int:
+    return int(key, 2)
+
+
+# there is one per tile of every generated chunk, so they are slotted
+@dataclass(frozen=True, slots=True)
 class Cell:
     i: int
     j: int
@@ -461,83 +526,163 @@ FOREST_TILEMAP = {
     "111010111": ["tree_1", "tree_2", "tree_3"],
 }
 
+# TILEMAP and FOREST_TILEMAP as dense tables indexed by `land_code` and
+# `forest_code`, with None for the missing combinations
+TILEMAP_TABLE = [None] * len(LAND_TYPES) ** 4
+for k, v in TILEMAP.items():
+    TILEMAP_TABLE[land_code(k)] = v
+
+FOREST_TILEMAP_TABLE = [None] * 2 ** 9
+for k, v in FOREST_TILEMAP.items():
+    FOREST_TILEMAP_TABLE[forest_code(k)] = v
+
+
+# TILEMAP_TABLE and FOREST_TILEMAP_TABLE with the indices of the tiles in a
+# TileTable instead of their names, resolved once for a tileset, the missing
+# foreground tiles being -1
+class TilemapTables:
+    def __init__(self, table: TileTable):
+        self.table = table
+        self.land = [
+            None if v is None else [
+                (table.index[bg], table.index.get(fg, -1)) for bg, fg in v
+            ]
+            for v in TILEMAP_TABLE
+        ]
+        self.forest = [
+            None if v is None else [table.index.get(fg, -1) for fg in v]
+            for v in FOREST_TILEMAP_TABLE
+        ]
+        self.invalid = table.index["spell_red"]
+
+
+# noise sampled on the integer lattice of the world, computed block by block
+# and cached, so that the overlapping borders of neighbouring chunks are only
+# evaluated once, the cache being bounded as the world has no end
+class NoiseField:
+    def __init__(
+        self,
+        noise: NoiseBackend,
+        block_size: int = NOISE_BLOCK_SIZE,
+        scale: float = NOISE_SCALE,
+        z: float = 0.0,
+        max_blocks: int = NOISE_CACHE_BLOCKS,
+    ):
+        self.noise = noise
+        self.block_size = block_size
+        self.scale = scale
+        self.z = z
+        self.max_blocks = max_blocks
+        self.blocks = OrderedDict()
+
+    def _block(self, bi: int, bj: int) -> np.ndarray:
+        if (bi, bj) in self.blocks:
+            self.blocks.move_to_end((bi, bj))
+            return self.blocks[bi, bj]
+
+        b = self.block_size
+        block = self.noise.grid(
+            np.arange(bi * b, (bi + 1) * b) / self.scale,
+            np.arange(bj * b, (bj + 1) * b) / self.scale,
+            self.z,
+        )
+        self.blocks[bi, bj] = block
+        if len(self.blocks) > self.max_blocks:
+            self.blocks.popitem(last=False)
+        return block
+
+    # the h x w window of the field with (i, j) as its top left corner
+    def window(self, i: int, j: int, h: int, w: int) -> np.ndarray:
+        b = self.block_size
+        values = np.empty((h, w))
+        for bi in range(i // b, (i + h - 1) // b + 1):
+            for bj in range(j // b, (j + w - 1) // b + 1):
+                i0, i1 = max(i, bi * b), min(i + h, (bi + 1) * b)
+                j0, j1 = max(j, bj * b), min(j + w, (bj + 1) * b)
+                values[i0 - i:i1 - i, j0 - j:j1 - j] = self._block(bi, bj)[
+                    i0 - bi * b:i1 - bi * b, j0 - bj * b:j1 - bj * b
+                ]
+        return values
+
 
 def generate_chunk(
-    terrain_noise: List[Tuple[float, PerlinNoise]],
-    biome_noise: List[Tuple[float, PerlinNoise]],
+    terrain_noise: NoiseField,
+    biome_noise: NoiseField,
     forest_threshold: float,
     land_heights: LandHeights,
     chunk: (int, int),
-    tileset: Dict[Name, Tile],
-    z: float = 0.0,
+    tilemaps: TilemapTables,
+    *,
+    chunk_size: int = CHUNK_SIZE,
 ) -> List[Cell]:
     chunk_i, chunk_j = chunk
-    chunk_i, chunk_j = chunk_i * CHUNK_SIZE, chunk_j * CHUNK_SIZE
+    chunk_i, chunk_j = chunk_i * chunk_size, chunk_j * chunk_size
 
-    terrain_noise_values = [
-        [
-            sum(
-                weight * n([i / CHUNK_SIZE, j / CHUNK_SIZE, z])
-                for weight, n in terrain_noise
-            )
-            for j in range(chunk_j, chunk_j + CHUNK_SIZE + 3)
-        ]
-        for i in range(chunk_i, chunk_i + CHUNK_SIZE + 3)
-    ]
+    terrain_noise_values = terrain_noise.window(
+        chunk_i, chunk_j, chunk_size + 3, chunk_size + 3
+    )
+    biome_noise_values = biome_noise.window(
+        chunk_i, chunk_j, chunk_size + 2, chunk_size + 2
+    )
 
-    biome_noise_values = [
-        [
-            sum(
-                weight * n([i / CHUNK_SIZE, j / CHUNK_SIZE, z])
-                for weight, n in biome_noise
-            )
-            for j in range(chunk_j, chunk_j + CHUNK_SIZE + 2)
-        ]
-        for i in range(chunk_i, chunk_i + CHUNK_SIZE + 2)
-    ]
+    land = to_land_type(terrain_noise_values, land_heights)
+    nw = land[1:chunk_size + 1, 1:chunk_size + 1]
+    ne = land[1:chunk_size + 1, 2:chunk_size + 2]
+    sw = land[2:chunk_size + 2, 1:chunk_size + 1]
+    se = land[2:chunk_size + 2, 2:chunk_size + 2]
+    n = len(LAND_TYPES)
+    codes = np.where(
+        (nw >= 0) & (ne >= 0) & (sw >= 0) & (se >= 0),
+        ((nw * n + ne) * n + sw) * n + se,
+        -1,
+    )
 
-    tlt = lambda x: to_land_type(x, land_heights=land_heights)
+    # a tile can be forest when its 4 corners are the same land, either grass
+    # or rock
+    corners = land[:-1, :-1]
+    forest = (
+        (biome_noise_values > forest_threshold)
+        & (corners == land[:-1, 1:])
+        & (corners == land[1:, :-1])
+        & (corners == land[1:, 1:])
+        & np.isin(corners, [LAND_TYPES.index(LT.GRASS), LAND_TYPES.index(LT.ROCK)])
+    )
+    forest_codes = sum(
+        forest[1 + di:chunk_size + 1 + di, 1 + dj:chunk_size + 1 + dj].astype(int)
+        << (8 - k)
+        for k, (di, dj) in enumerate(
+            (di, dj) for di in (-1, 0, 1) for dj in (-1, 0, 1)
+        )
+    )
 
+    codes = codes.tolist()
+    forest_codes = forest_codes.tolist()
+    forest = forest.tolist()
+
+    tiles = tilemaps.table.tiles
     cells = []
     incomplete, bad_tile = False, None
-    for i in range(1, CHUNK_SIZE + 1):
-        for j in range(1, CHUNK_SIZE + 1):
-            nw = tlt(terrain_noise_values[i][j])
-            ne = tlt(terrain_noise_values[i][j + 1])
-            sw = tlt(terrain_noise_values[i + 1][j])
-            se = tlt(terrain_noise_values[i + 1][j + 1])
-            key = ''.join([nw.value, ne.value, sw.value, se.value])
-
-            bg, fg = choice(TILEMAP.get(key, [("spell_red", None)]))
-
-            valid = [LT.GRASS, LT.ROCK]
-            forest = [
-                (
-                    biome_noise_values[a][b] > forest_threshold and
-                    tlt(terrain_noise_values[a][b]) ==
-                    tlt(terrain_noise_values[a][b + 1]) ==
-                    tlt(terrain_noise_values[a + 1][b]) ==
-                    tlt(terrain_noise_values[a + 1][b + 1]) and
-                    tlt(terrain_noise_values[a][b]) in valid
+    for i in range(chunk_size):
+        for j in range(chunk_size):
+            candidates = tilemaps.land[codes[i][j]] if codes[i][j] >= 0 else None
+            bg, fg = choice(candidates or [(tilemaps.invalid, -1)])
+
+            if forest[i + 1][j + 1]:
+                fg = choice(
+                    tilemaps.forest[forest_codes[i][j]] or [tilemaps.invalid]
                 )
-                for a, b in [
-                    (i - 1, j - 1), (i - 1, j), (i - 1, j + 1),
-                    (i, j - 1),     (i, j),     (i, j + 1),
-                    (i + 1, j - 1), (i + 1, j), (i + 1, j + 1),
-                ]
-            ]
-
-            if forest[4]:
-                fkey = ''.join(map(str, map(int, forest)))
-                fg = choice(FOREST_TILEMAP.get(fkey, ["spell_red"]))
 
-            if key not in TILEMAP:
-                incomplete, bad_tile = True, (nw, ne, sw, se)
+            if candidates is None:
+                incomplete = True
+                bad_tile = tuple(
+                    LAND_TYPES[x[i, j]] if x[i, j] >= 0 else None
+                    for x in (nw, ne, sw, se)
+                )
 
             cells.append(Cell(
-                i - 1, j - 1,
-                background=tileset[bg],
-                foreground=tileset.get(fg),
+                i, j,
+                background=tiles[bg],
+                foreground=tiles[fg] if fg >= 0 else None,
             ))
 
     if incomplete:
@@ -546,102 +691,394 @@ def generate_chunk(
     return cells
 
 
-def take_screenshot(screen: pygame.surface.Surface):
-    out = f"{time_ns()}.png"
-    image = np.transpose(pygame.surfarray.array3d(screen), (1, 0, 2))
-    Image.fromarray(image).save(out)
-    info(f"window saved in [purple]{out}[/purple]")
+# the (2, chunk_size, chunk_size) Tiled global ids of the background and
+# foreground tiles of a chunk
+def chunk_layers(cells: List[Cell], *, chunk_size: int = CHUNK_SIZE) -> np.ndarray:
+    layers = np.zeros((len(MAP_LAYERS), chunk_size, chunk_size), dtype=np.uint32)
+    for c in cells:
+        layers[0, c.i, c.j] = c.background.id + FIRST_GID
+        if c.foreground is not None:
+            layers[1, c.i, c.j] = c.foreground.id + FIRST_GID
+    return layers
+
+
+# the generated chunks as a map, as they are in the chunked format, and in
+# their bounding box, with no tile where chunks are missing, otherwise
+def export_world(
+    path: Path,
+    chunks: Dict[Tuple[int, int], List[Cell]],
+    sheet: Sheet,
+    *,
+    chunk_size: int = CHUNK_SIZE,
+):
+    layers = {
+        c: chunk_layers(cells, chunk_size=chunk_size)
+        for c, cells in chunks.items()
+    }
+    # the viewer keeps running whatever happens to the export
+    try:
+        if path.suffix == CHUNKED_MAP_SUFFIX:
+            write_chunked_map(path, layers, MAP_LAYERS, chunk_size)
+        else:
+            i0, j0 = min(i for i, _ in layers), min(j for _, j in layers)
+            i1, j1 = max(i for i, _ in layers), max(j for _, j in layers)
+            world = np.zeros(
+                (
+                    len(MAP_LAYERS),
+                    (i1 - i0 + 1) * chunk_size,
+                    (j1 - j0 + 1) * chunk_size,
+                ),
+                dtype=np.uint32,
+            )
+            for (i, j), chunk in layers.items():
+                i, j = (i - i0) * chunk_size, (j - j0) * chunk_size
+                world[:, i:i + chunk_size, j:j + chunk_size] = chunk
+            write_map(
+                path, dict(zip(MAP_LAYERS, world)), sheet, chunk_size=chunk_size
+            )
+    except Exception as e:
+        warning(f"world not saved in [purple]{path}[/purple]: {e}")
+        return
+    info(f"world saved in [purple]{path}[/purple]")
+
+
+def take_screenshot(screen: pygame.surface.Surface, writer: ScreenshotWriter):
+    writer.save(screen, f"{time_ns()}.png")
 
     w, h = screen.get_size()
     pygame.draw.rect(screen, RED, (0, 0, w, h), width=10)
     pygame.display.flip()
 
 
-def handle_events() -> (bool, bool, (int, int), bool, bool):
+# what happened since the last frame, nothing by default
+@dataclass(frozen=True)
+class Events:
+    running: bool = True
+    screenshot: bool = False
+    # the direction the camera moves to, as (di, dj)
+    move: Tuple[int, int] | None = None
+    toggle_debug: bool = False
+    window_resized: bool = False
+    # the number of zoom levels to zoom in, negative to zoom out
+    wheel: int = 0
+    toggle_minimap: bool = False
+    export: bool = False
+    capture: bool = False
+
+
+def handle_events() -> Events:
     for event in pygame.event.get():
         if event.type == pygame.QUIT or (
             event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE
         ):
-            return False, False, None, False, False
+            return Events(running=False)
         elif event.type == pygame.KEYDOWN:
             if event.key == pygame.K_F2:
-                return True, True, None, False, False
+                return Events(screenshot=True)
             elif event.key == pygame.K_h:
-                return True, False, (0, -1), False, False
+                return Events(move=(0, -1))
             elif event.key == pygame.K_l:
-                return True, False, (0, +1), False, False
+                return Events(move=(0, +1))
             elif event.key == pygame.K_j:
-                return True, False, (+1, 0), False, False
+                return Events(move=(+1, 0))
             elif event.key == pygame.K_k:
-                return True, False, (-1, 0), False, False
+                return Events(move=(-1, 0))
             elif event.key == pygame.K_F3:
-                return True, False, None, True, False
+                return Events(toggle_debug=True)
+            elif event.key == pygame.K_m:
+                return Events(toggle_minimap=True)
+            elif event.key == pygame.K_F4:
+                return Events(export=True)
+            elif event.key == pygame.K_F5:
+                return Events(capture=True)
         elif event.type == pygame.WINDOWRESIZED:
-            return True, False, None, False, True
+            return Events(window_resized=True)
+        elif event.type == pygame.MOUSEWHEEL:
+            zoom = -event.y if event.flipped else event.y
+            return Events(wheel=zoom)
+
+    return Events()
 
-    return True, False, None, False, False
+
+# the steps of the animations, by the id of their tile, for the animations
+# `get_animation_steps` finds
+def animation_table(
+    animations: List[Animation],
+) -> Dict[int, Tuple[AnimationStep, ...]]:
+    ids = [a.id for a in animations]
+    return {a.id: a.animation for a in animations if ids.count(a.id) == 1}
+
+
+# the images of the tiles of the world, all cut from the same sheet, scaled to
+# the size of the tiles on screen and in the pixel format of the screen, each
+# one converted the first time it is drawn, and all of them dropped when the
+# zoom changes
+class ScaledTiles:
+    def __init__(self):
+        self.images: Dict[int, pygame.surface.Surface] = {}
+        self.s = None
+
+    # the scaled images of the tiles drawn so far, by tile id, at size s
+    def at(self, s: int) -> Dict[int, pygame.surface.Surface]:
+        if s != self.s:
+            self.images = {}
+            self.s = s
+        return self.images
+
+    def get(self, tile: Tile, s: int) -> pygame.surface.Surface:
+        images = self.at(s)
+        if tile.id not in images:
+            images[tile.id] = pygame.transform.scale(
+                tile.image, (s, s)
+            ).convert_alpha()
+        return images[tile.id]
 
 
 def blit(
     screen: pygame.surface.Surface,
     chunks: Dict[Tuple[int, int], List[Cell]],
-    animations: List[Animation],
+    animations: Dict[int, Tuple[AnimationStep, ...]],
+    scaled: ScaledTiles,
     pos: (float, float),
     *,
     t: int,
     s: int,
-    debug: bool = False,
+    chunk_size: int = CHUNK_SIZE,
 ):
     w, h = screen.get_size()
     dx, dy = pos
 
+    # the animated tiles are the same for the whole frame
+    step = (t // ANIMATION_INV_SPEED) % ANIMATION_SEQUENCE_LEN
+    frame = {
+        id: steps[step].tile
+        for id, steps in animations.items()
+        if step < len(steps)
+    }
+
+    # there are thousands of tiles on screen, so the scaled images are looked
+    # up directly, and only scaled on a miss
+    images = scaled.at(s)
+    sprites = []
     for (pi, pj), cells in chunks.items():
+        x0 = w / 2 + pj * chunk_size * s - dx
+        y0 = h / 2 + pi * chunk_size * s - dy
         for c in cells:
-            try:
-                tile = get_animation_steps(c.background.id, animations)[
-                    (t // ANIMATION_INV_SPEED) % ANIMATION_SEQUENCE_LEN
-                ].tile
-            except Exception:
-                tile = c.background
-            cell_pos = (
-                w / 2 + (pj * CHUNK_SIZE + c.j) * s - dx,
-                h / 2 + (pi * CHUNK_SIZE + c.i) * s - dy,
-            )
-            screen.blit(pygame.transform.scale(tile.image, (s, s)), cell_pos)
+            tile = frame.get(c.background.id, c.background)
+            cell_pos = (x0 + c.j * s, y0 + c.i * s)
+            image = images.get(tile.id) or scaled.get(tile, s)
+            sprites.append((image, cell_pos))
             if c.foreground is not None:
-                screen.blit(
-                    pygame.transform.scale(c.foreground.image, (s, s)),
-                    cell_pos,
-                )
+                image = images.get(c.foreground.id) or scaled.get(c.foreground, s)
+                sprites.append((image, cell_pos))
+    screen.blits(sprites, doreturn=False)
+
+    pygame.draw.circle(screen, RED, (w / 2, h / 2), 10)
+
 
-    if debug:
-        chunk_s = CHUNK_SIZE * s
-        # draw a slightly transparent grid on top of the chunks
-        for (pi, pj), _ in chunks.items():
-            rect = (
-                w / 2 + pj * chunk_s - dx,
-                h / 2 + pi * chunk_s - dy,
-                chunk_s, chunk_s
+# the tiles of a region of the world, from its top left tile (i, j) and its
+# size (h, w) in tiles, drawn offscreen at the resolution of the tileset
+#
+# the tiles come straight from the chunks, the missing ones being generated
+# with `generate` without being kept
+def render_region(
+    chunks: Dict[Tuple[int, int], List[Cell]],
+    generate: Callable[[Tuple[int, int]], List[Cell]],
+    region: (int, int, int, int),
+    *,
+    s: int,
+    chunk_size: int = CHUNK_SIZE,
+) -> pygame.surface.Surface:
+    i0, j0, h, w = region
+    canvas = pygame.Surface((w * s, h * s))
+    canvas.fill(BLACK)
+
+    for pi in range(i0 // chunk_size, (i0 + h - 1) // chunk_size + 1):
+        for pj in range(j0 // chunk_size, (j0 + w - 1) // chunk_size + 1):
+            cells = chunks.get((pi, pj))
+            if cells is None:
+                cells = generate((pi, pj))
+            for c in cells:
+                i, j = pi * chunk_size + c.i - i0, pj * chunk_size + c.j - j0
+                if not (0 <= i < h and 0 <= j < w):
+                    continue
+                canvas.blit(c.background.image, (j * s, i * s))
+                if c.foreground is not None:
+                    canvas.blit(c.foreground.image, (j * s, i * s))
+
+    return canvas
+
+
+# the tiles which are at least partly on the screen, as a region for
+# `render_region`
+def view_region(
+    screen_size: (int, int), pos: (float, float), *, s: int
+) -> (int, int, int, int):
+    w, h = screen_size
+    dx, dy = pos
+    i0, j0 = math.floor((dy - h / 2) / s), math.floor((dx - w / 2) / s)
+    i1, j1 = math.ceil((dy + h / 2) / s), math.ceil((dx + w / 2) / s)
+    return i0, j0, i1 - i0, j1 - j0
+
+
+# a chunk with one pixel per tile, with the foreground tiles on top of the
+# background ones
+def chunk_thumbnail(
+    cells: List[Cell], *, chunk_size: int = CHUNK_SIZE
+) -> pygame.surface.Surface:
+    background = np.zeros((chunk_size, chunk_size, 4))
+    foreground = np.zeros((chunk_size, chunk_size, 4))
+    for c in cells:
+        background[c.i, c.j] = c.background.color
+        if c.foreground is not None:
+            foreground[c.i, c.j] = c.foreground.color
+    return minimap([background, foreground])
+
+
+# the thumbnails of the chunks, scaled to the size of the tiles on screen
+#
+# thumbnails are built once, along with their chunk, so that zooming out
+# doesn't stall on thousands of them, only their scaled copies are dropped when
+# the zoom changes
+class ChunkThumbnails:
+    def __init__(self, chunk_size: int = CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.thumbnails: Dict[Tuple[int, int], pygame.surface.Surface] = {}
+        self.scaled: Dict[Tuple[int, int], pygame.surface.Surface] = {}
+        self.s = 1
+
+    def add(self, chunk: Tuple[int, int], cells: List[Cell]):
+        self.thumbnails[chunk] = chunk_thumbnail(
+            cells, chunk_size=self.chunk_size
+        )
+
+    def get(self, chunk: Tuple[int, int], s: int) -> pygame.surface.Surface:
+        if s != self.s:
+            self.scaled = {}
+            self.s = s
+
+        if s == 1:
+            return self.thumbnails[chunk]
+        if chunk not in self.scaled:
+            size = self.chunk_size * s
+            self.scaled[chunk] = pygame.transform.scale(
+                self.thumbnails[chunk], (size, size)
             )
-            color = BLACK + (64,)
-            shape_surf = pygame.Surface(
-                pygame.Rect(rect).size, pygame.SRCALPHA
+        return self.scaled[chunk]
+
+    # drops the scaled thumbnails of the chunks out of view, the thumbnails
+    # themselves are kept for the minimap
+    def evict(self, visible: Set[Tuple[int, int]]):
+        self.scaled = {c: t for c, t in self.scaled.items() if c in visible}
+
+
+def blit_thumbnails(
+    screen: pygame.surface.Surface,
+    thumbnails: ChunkThumbnails,
+    chunks: Dict[Tuple[int, int], List[Cell]],
+    pos: (float, float),
+    *,
+    s: int,
+    chunk_size: int = CHUNK_SIZE,
+):
+    w, h = screen.get_size()
+    dx, dy = pos
+
+    chunk_s = chunk_size * s
+    screen.blits(
+        [
+            (
+                thumbnails.get((pi, pj), s),
+                (w / 2 + pj * chunk_s - dx, h / 2 + pi * chunk_s - dy),
             )
-            pygame.draw.rect(shape_surf, color, shape_surf.get_rect(), width=1)
-            screen.blit(shape_surf, rect)
+            for pi, pj in chunks
+        ],
+        doreturn=False,
+    )
+
+    pygame.draw.circle(screen, RED, (w / 2, h / 2), 10)
 
+
+# the chunks around the camera, one pixel per tile, in the top right corner of
+# the screen
+def blit_minimap(
+    screen: pygame.surface.Surface,
+    thumbnails: ChunkThumbnails,
+    pos: (float, float),
+    *,
+    s: int,
+    radius: int = MINIMAP_RADIUS,
+    chunk_size: int = CHUNK_SIZE,
+):
+    w, _ = screen.get_size()
+    pj, pi = to_chunk_space(pos, chunk_size=chunk_size)
+
+    size = (2 * radius + 1) * chunk_size
+    surface = pygame.Surface((size, size))
+    surface.blits(
+        [
+            (
+                thumbnails.thumbnails[(pi + i, pj + j)],
+                ((j + radius) * chunk_size, (i + radius) * chunk_size),
+            )
+            for i in range(-radius, radius + 1)
+            for j in range(-radius, radius + 1)
+            if (pi + i, pj + j) in thumbnails.thumbnails
+        ],
+        doreturn=False,
+    )
+
+    x, y = pos
+    camera = (
+        x / s - (pj - radius) * chunk_size,
+        y / s - (pi - radius) * chunk_size,
+    )
+    pygame.draw.circle(surface, RED, camera, 3)
+    pygame.draw.rect(surface, GREY, surface.get_rect(), width=1)
+
+    screen.blit(surface, (w - size - 10, 10))
+
+
+def blit_debug_grid(
+    screen: pygame.surface.Surface,
+    font: pygame.font.SysFont,
+    chunks: Dict[Tuple[int, int], List[Cell]],
+    pos: (float, float),
+    *,
+    s: int,
+    chunk_size: int = CHUNK_SIZE,
+):
+    w, h = screen.get_size()
+    dx, dy = pos
+
+    chunk_s = chunk_size * s
+    # the coordinates of the chunks don't fit in them when zoomed out
+    labels = font.size("(-00, -00)")[0] <= chunk_s
+    # draw a slightly transparent grid on top of the chunks
+    for (pi, pj), _ in chunks.items():
+        rect = (
+            w / 2 + pj * chunk_s - dx,
+            h / 2 + pi * chunk_s - dy,
+            chunk_s, chunk_s
+        )
+        color = BLACK + (64,)
+        shape_surf = pygame.Surface(
+            pygame.Rect(rect).size, pygame.SRCALPHA
+        )
+        pygame.draw.rect(shape_surf, color, shape_surf.get_rect(), width=1)
+        screen.blit(shape_surf, rect)
+
+        if labels:
             text = font.render(f"({pi}, {pj})", False, color)
             screen.blit(text, rect[:2])
 
-    pygame.draw.circle(screen, RED, (w / 2, h / 2), 10)
-
 
 def blit_debug_pannel(
     screen: pygame.surface.Surface,
     font: pygame.font.SysFont,
     clock: pygame.time.Clock,
     chunks: Dict[Tuple[int, int], List[Cell]],
-    chunks_to_load: List[Tuple[int, int]],
+    chunks_to_load: "ChunkQueue",
     *,
     pos: (int, int),
 ):
@@ -654,23 +1091,282 @@ def blit_debug_pannel(
     screen.blit(text, (x, y - text.get_height()))
 
 
-def to_chunk_space(pos: (float, float)) -> (int, int):
+# splits each frame into named sections and keeps a rolling history of their
+# durations, in ms
+class FrameProfiler:
+    def __init__(self, sections: List[str], history: int = PROFILER_HISTORY):
+        self.sections = sections
+        self.samples = {k: deque(maxlen=history) for k in sections}
+        self.totals = deque(maxlen=history)
+        self._current = {}
+        self._last = None
+
+    def start(self):
+        self._current = {k: 0 for k in self.sections}
+        self._last = perf_counter_ns()
+
+    def lap(self, section: str):
+        now = perf_counter_ns()
+        self._current[section] += now - self._last
+        self._last = now
+
+    def stop(self):
+        for k, v in self._current.items():
+            self.samples[k].append(v / 1_000_000)
+        self.totals.append(sum(self._current.values()) / 1_000_000)
+
+    def percentiles(self, section: str | None = None) -> (float, float, float):
+        values = self.totals if section is None else self.samples[section]
+        if len(values) == 0:
+            return 0.0, 0.0, 0.0
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        return p50, p95, p99
+
+
+# decides how many chunks to generate in a frame, from the time budget given
+# to chunk generation and a moving average of the time one chunk takes, in ms
+#
+# at least one chunk is always generated, so that the world keeps loading even
+# when a single chunk doesn't fit in the budget
+class ChunkScheduler:
+    def __init__(self, budget: float, smoothing: float = CHUNK_TIME_SMOOTHING):
+        self.budget = budget
+        self.smoothing = smoothing
+        self.average = None
+
+    def record(self, duration: float):
+        if self.average is None:
+            self.average = duration
+        else:
+            self.average += self.smoothing * (duration - self.average)
+
+    def has_time(self, elapsed: float, generated: int) -> bool:
+        if generated == 0:
+            return True
+        return elapsed + (self.average or 0.0) <= self.budget
+
+
+def blit_profiler(
+    screen: pygame.surface.Surface,
+    font: pygame.font.SysFont,
+    profiler: FrameProfiler,
+    *,
+    pos: (int, int),
+    budget: float,
+):
+    x, y = pos
+
+    rows = [(k, PROFILER_COLORS[k], profiler.percentiles(k)) for k in profiler.sections]
+    rows.append(("frame", GREY, profiler.percentiles()))
+
+    text = font.render("p50 | p95 | p99 (ms)", False, GREY, BLACK)
+    screen.blit(text, (x, y))
+    y += text.get_height()
+    for name, color, (p50, p95, p99) in rows:
+        msg = f"{name}: {p50:.2f} | {p95:.2f} | {p99:.2f}"
+        text = font.render(msg, False, color, BLACK)
+        screen.blit(text, (x, y))
+        y += text.get_height()
+
+    # stacked bars, one per frame, with the frame budget as a horizontal line
+    graph = pygame.Rect(x, y, profiler.totals.maxlen, PROFILER_GRAPH_HEIGHT)
+    pygame.draw.rect(screen, BLACK, graph)
+    scale = PROFILER_GRAPH_HEIGHT / (2 * budget)
+    for i in range(len(profiler.totals)):
+        bottom = graph.bottom
+        for k in profiler.sections:
+            bar = min(profiler.samples[k][i] * scale, bottom - graph.top)
+            if bar > 0:
+                pygame.draw.line(
+                    screen,
+                    PROFILER_COLORS[k],
+                    (graph.left + i, bottom),
+                    (graph.left + i, bottom - bar),
+                )
+            bottom -= bar
+    budget_y = graph.bottom - budget * scale
+    pygame.draw.line(screen, RED, (graph.left, budget_y), (graph.right, budget_y))
+    pygame.draw.rect(screen, GREY, graph, width=1)
+
+
+def to_chunk_space(
+    pos: (float, float), *, chunk_size: int = CHUNK_SIZE
+) -> (int, int):
     x, y = pos
     return (
-        int((x // tile_size) // CHUNK_SIZE),
-        int((y // tile_size) // CHUNK_SIZE),
+        int((x // tile_size) // chunk_size),
+        int((y // tile_size) // chunk_size),
     )
 
 
 def chunks_around(
-    pos: (float, float), *, h: int, w: int
+    pos: (float, float), *, h: int, w: int, chunk_size: int = CHUNK_SIZE
 ) -> List[Tuple[int, int]]:
-    pj, pi = to_chunk_space(pos)
+    pj, pi = to_chunk_space(pos, chunk_size=chunk_size)
     h = h // 2 + 1
     w = w // 2 + 1
     return [(pi + i, pj + j) for i in range(-h, h) for j in range(-w, w)]
 
 
+# chunks waiting to be generated, by priority, the lowest first
+#
+# queueing a chunk again with a lower priority moves it ahead, the stale entry
+# is skipped once it reaches the top of the heap, and the whole queue is
+# emptied with `clear` when the chunks it was filled for are not wanted anymore
+class ChunkQueue:
+    def __init__(self):
+        self._heap = []
+        self._priorities: Dict[Tuple[int, int], Tuple[int, float]] = {}
+        self._counter = 0
+
+    def push(self, chunk: Tuple[int, int], priority: Tuple[int, float]):
+        if chunk in self._priorities and self._priorities[chunk] <= priority:
+            return
+        self._priorities[chunk] = priority
+        heapq.heappush(self._heap, (priority, self._counter, chunk))
+        self._counter += 1
+
+    def clear(self):
+        self._heap = []
+        self._priorities = {}
+
+    def pop(self) -> Tuple[int, int]:
+        while True:
+            priority, _, chunk = heapq.heappop(self._heap)
+            if self._priorities.get(chunk) == priority:
+                del self._priorities[chunk]
+                return chunk
+
+    def __contains__(self, chunk: Tuple[int, int]) -> bool:
+        return chunk in self._priorities
+
+    def __len__(self) -> int:
+        return len(self._priorities)
+
+
+# the speed of the camera, in pixels per frame, from its last positions
+class CameraMotion:
+    def __init__(self, history: int = PREFETCH_HISTORY):
+        self.positions = deque(maxlen=history)
+
+    def update(self, pos: (float, float)):
+        self.positions.append(pos)
+
+    def reset(self):
+        self.positions.clear()
+
+    def velocity(self) -> (float, float):
+        if len(self.positions) < 2:
+            return 0.0, 0.0
+        (x0, y0), (x1, y1) = self.positions[0], self.positions[-1]
+        n = len(self.positions) - 1
+        return (x1 - x0) / n, (y1 - y0) / n
+
+
+# queues the missing chunks in view first, the closest to the center of the
+# screen first, then the ones around the view and along the way of the camera,
+# the closest to its predicted position `ahead` first
+#
+# the queue is filled again from scratch, so that chunks which were requested
+# for a previous position or zoom, and their priorities, don't get in the way
+def request_chunks(
+    queue: ChunkQueue,
+    chunks: Dict[Tuple[int, int], List[Cell]],
+    pos: (float, float),
+    ahead: (float, float),
+    visible: Set[Tuple[int, int]],
+    *,
+    h: int,
+    w: int,
+    margin: int = PREFETCH_MARGIN,
+    chunk_size: int = CHUNK_SIZE,
+):
+    queue.clear()
+
+    pj, pi = to_chunk_space(pos, chunk_size=chunk_size)
+    for c in visible:
+        if c not in chunks:
+            queue.push(c, (0, math.dist(c, (pi, pj))))
+
+    aj, ai = to_chunk_space(ahead, chunk_size=chunk_size)
+
+    # the view around both the camera and its predicted position, with a
+    # margin, and everything in between
+    h = h // 2 + 1 + margin
+    w = w // 2 + 1 + margin
+    for i in range(min(pi, ai) - h, max(pi, ai) + h):
+        for j in range(min(pj, aj) - w, max(pj, aj) + w):
+            c = (i, j)
+            if c not in chunks and c not in visible:
+                queue.push(c, (1, math.dist(c, (ai, aj))))
+
+
+# the chunks in view, and the ones to generate, only computed again when the
+# camera or its predicted position crosses the border of a chunk, or when the
+# window is resized or zoomed, instead of in every frame
+#
+# `update` tells if the view changed, for the caches of the view to evict what
+# is not in view anymore
+class ChunkView:
+    def __init__(
+        self,
+        *,
+        margin: int = PREFETCH_MARGIN,
+        horizon: int = PREFETCH_HORIZON,
+        chunk_size: int = CHUNK_SIZE,
+    ):
+        self.margin = margin
+        self.horizon = horizon
+        self.chunk_size = chunk_size
+        self.visible: Set[Tuple[int, int]] = set()
+        # the chunks in view which are already generated
+        self.chunks: Dict[Tuple[int, int], List[Cell]] = {}
+        self._key = None
+
+    def update(
+        self,
+        queue: ChunkQueue,
+        chunks: Dict[Tuple[int, int], List[Cell]],
+        pos: (float, float),
+        velocity: (float, float),
+        *,
+        h: int,
+        w: int,
+    ) -> bool:
+        vx, vy = velocity
+        ahead = (pos[0] + vx * self.horizon, pos[1] + vy * self.horizon)
+        key = (
+            to_chunk_space(pos, chunk_size=self.chunk_size),
+            to_chunk_space(ahead, chunk_size=self.chunk_size),
+            h,
+            w,
+        )
+        if key == self._key:
+            return False
+        self._key = key
+
+        self.visible = set(
+            chunks_around(pos, h=h, w=w, chunk_size=self.chunk_size)
+        )
+        self.chunks = {c: chunks[c] for c in self.visible if c in chunks}
+        request_chunks(
+            queue,
+            chunks,
+            pos,
+            ahead,
+            self.visible,
+            h=h,
+            w=w,
+            margin=self.margin,
+            chunk_size=self.chunk_size,
+        )
+        return True
+
+    def add(self, chunk: Tuple[int, int], cells: List[Cell]):
+        if chunk in self.visible:
+            self.chunks[chunk] = cells
+
+
 def is_number(obj: Any) -> bool:
     return isinstance(obj, float) or isinstance(obj, int)
 
@@ -712,6 +1408,22 @@ def noise_as_json():
     return type_func
 
 
+def region():
+    def type_func(val: str) -> (int, int, int, int):
+        try:
+            i, j, h, w = map(int, val.split(","))
+        except ValueError:
+            raise argparse.ArgumentTypeError(
+                f"expected I,J,H,W, found {val}"
+            )
+        if h <= 0 or w <= 0:
+            raise argparse.ArgumentTypeError(
+                f"the region should not be empty, found {h}x{w} tiles"
+            )
+        return i, j, h, w
+    return type_func
+
+
 def land_heights_as_json():
     def type_func(val: str) -> LandHeights:
         try:
@@ -740,8 +1452,42 @@ if __name__ == "__main__":
     parser.add_argument("--biome-noise", type=noise_as_json(), required=True)
     parser.add_argument("--forest-threshold", type=float, default=0.0)
     parser.add_argument("--land-heights", type=land_heights_as_json(), required=True)
+    parser.add_argument("--tileset", type=Path, default=Path("../../punyworld.json"))
+    parser.add_argument(
+        "--noise-backend", choices=NOISE_BACKENDS.keys(), default="numpy"
+    )
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--noise-scale", type=float, default=NOISE_SCALE)
+    parser.add_argument(
+        "--map-format",
+        choices=["tmj", "tmx", CHUNKED_MAP_SUFFIX[1:]],
+        default="tmj",
+        help="format of the maps exported with F4",
+    )
+    parser.add_argument(
+        "--prefetch-margin",
+        type=int,
+        default=PREFETCH_MARGIN,
+        help="number of chunks around the view to generate ahead of time",
+    )
+    parser.add_argument(
+        "--chunk-budget",
+        type=float,
+        help="time given to chunk generation in each frame, in ms, defaults to "
+        "half the frame time",
+    )
+    parser.add_argument(
+        "--capture",
+        type=region(),
+        help="renders the I,J,H,W region of the world, from its top left tile "
+        "and its size in tiles, in an image at the resolution of the tileset, "
+        "and exits",
+    )
     args = parser.parse_args()
 
+    if args.chunk_budget is None:
+        args.chunk_budget = 1000 / args.frame_rate / 2
+
     pygame.init()
     pygame.font.init()
     font = pygame.font.SysFont("mononokinerdfont", 30)
@@ -751,95 +1497,216 @@ if __name__ == "__main__":
     clock = pygame.time.Clock()
     dt = 0
 
-    tiles, animations, _ = load_tileset(Path("../../punyworld.json"))
+    tiles, animations, _ = load_tileset(args.tileset)
+    tilemaps = TilemapTables(TileTable(tiles))
+    zoom = ZOOM_LEVELS.index(tile_size)
+
+    backend = NOISE_BACKENDS[args.noise_backend]
+    terrain_noise = NoiseField(
+        backend(args.terrain_noise, seed=args.seed),
+        scale=args.noise_scale,
+    )
+    biome_noise = NoiseField(
+        backend(args.biome_noise, seed=args.seed),
+        scale=args.noise_scale,
+    )
 
-    terrain_noise = [
-        (n["amplitude"], PerlinNoise(octaves=n["octaves"], seed=args.seed))
-        for n in args.terrain_noise
-    ]
-    biome_noise = [
-        (n["amplitude"], PerlinNoise(octaves=n["octaves"], seed=args.seed))
-        for n in args.biome_noise
-    ]
+    chunk_size = args.chunk_size
+    native_tile_size, _ = next(iter(tiles.values())).sheet.size
+
+    def generate(chunk: Tuple[int, int]) -> List[Cell]:
+        return generate_chunk(
+            terrain_noise,
+            biome_noise,
+            args.forest_threshold,
+            args.land_heights,
+            chunk,
+            tilemaps,
+            chunk_size=chunk_size,
+        )
 
-    chunks_w, chunks_h = to_chunk_space(screen.get_size())
+    screenshots = ScreenshotWriter(
+        on_saved=lambda out: info(f"image saved in [purple]{out}[/purple]")
+    )
+
+    if args.capture is not None:
+        with screenshots:
+            screenshots.save(
+                render_region(
+                    {},
+                    generate,
+                    args.capture,
+                    s=native_tile_size,
+                    chunk_size=chunk_size,
+                ),
+                f"{time_ns()}.png",
+            )
+        exit(0)
+
+    chunks_w, chunks_h = to_chunk_space(
+        screen.get_size(), chunk_size=chunk_size
+    )
 
     w, h = window_size
     pos = (0, 0)
     chunks = {}
 
-    chunks_to_load = chunks_around(pos, h=chunks_h, w=chunks_w)
+    chunks_to_load = ChunkQueue()
+    camera = CameraMotion()
+    view = ChunkView(margin=args.prefetch_margin, chunk_size=chunk_size)
+    thumbnails = ChunkThumbnails(chunk_size=chunk_size)
+    scaled_tiles = ScaledTiles()
+    animation_steps = animation_table(animations)
 
     debug = False
+    show_minimap = False
+    profiler = FrameProfiler(PROFILER_SECTIONS)
+    scheduler = ChunkScheduler(args.chunk_budget)
 
     t = 0
     running = True
     while running:
-        (
-            running, screenshot, move, toggle_debug, window_resized
-        ) = handle_events()
+        profiler.start()
+
+        events = handle_events()
+        running = events.running
+
+        new_zoom = min(max(zoom + events.wheel, 0), len(ZOOM_LEVELS) - 1)
+        if new_zoom != zoom:
+            # zoom around the center of the screen
+            ratio = ZOOM_LEVELS[new_zoom] / tile_size
+            pos = (pos[0] * ratio, pos[1] * ratio)
+            zoom, tile_size = new_zoom, ZOOM_LEVELS[new_zoom]
+            # the positions before the zoom are not in the same space
+            camera.reset()
+            info(f"zooming to {tile_size} px per tile")
+
+        if events.window_resized or events.wheel != 0:
+            if events.window_resized:
+                info(f"resizing window to {screen.get_size()}")
+            chunks_w, chunks_h = to_chunk_space(
+                screen.get_size(), chunk_size=chunk_size
+            )
 
-        if window_resized:
-            info(f"resizing window to {screen.get_size()}")
-            chunks_w, chunks_h = to_chunk_space(screen.get_size())
+        if events.screenshot:
+            take_screenshot(screen, screenshots)
+
+        if events.capture:
+            screenshots.save(
+                render_region(
+                    chunks,
+                    generate,
+                    view_region(screen.get_size(), pos, s=tile_size),
+                    s=native_tile_size,
+                    chunk_size=chunk_size,
+                ),
+                f"{time_ns()}.png",
+            )
 
-            for c in chunks_around(pos, h=chunks_h, w=chunks_w):
-                if c not in chunks and c not in chunks_to_load:
-                    chunks_to_load.append(c)
+        if events.toggle_debug:
+            debug = not debug
 
-        if screenshot:
-            take_screenshot(screen)
+        if events.toggle_minimap:
+            show_minimap = not show_minimap
 
-        if toggle_debug:
-            debug = not debug
+        if events.export and len(chunks) > 0:
+            export_world(
+                Path(f"{time_ns()}.{args.map_format}"),
+                chunks,
+                next(iter(tiles.values())).sheet,
+                chunk_size=chunk_size,
+            )
 
-        if move is not None:
-            mi, mj = move
+        if events.move is not None:
+            mi, mj = events.move
             pos = (pos[0] + mj * 64, pos[1] + mi * 64)
 
-            for c in chunks_around(pos, h=chunks_h, w=chunks_w):
-                if c not in chunks and c not in chunks_to_load:
-                    chunks_to_load.append(c)
+        camera.update(pos)
+        if view.update(
+            chunks_to_load, chunks, pos, camera.velocity(), h=chunks_h, w=chunks_w
+        ):
+            thumbnails.evict(view.visible)
+
+        profiler.lap("events")
 
-        if len(chunks_to_load) > 0:
-            new_chunk = chunks_to_load.pop(0)
+        elapsed, generated = 0.0, 0
+        while len(chunks_to_load) > 0 and scheduler.has_time(elapsed, generated):
+            new_chunk = chunks_to_load.pop()
             info(f"generating chunk {new_chunk}...", end=' ')
-            t = time_ns()
-            chunks[new_chunk] = generate_chunk(
-                terrain_noise,
-                biome_noise,
-                args.forest_threshold,
-                args.land_heights,
-                new_chunk,
-                tiles,
-            )
-            rich.print(f"done in {round((time_ns() - t) / 1_000_000, 2)} ms")
+            start = time_ns()
+            chunks[new_chunk] = generate(new_chunk)
+            view.add(new_chunk, chunks[new_chunk])
+            thumbnails.add(new_chunk, chunks[new_chunk])
+            duration = (time_ns() - start) / 1_000_000
+            rich.print(f"done in {round(duration, 2)} ms")
+
+            scheduler.record(duration)
+            elapsed += duration
+            generated += 1
+
+        profiler.lap("chunks")
 
         screen.fill(BLACK)
 
-        blit(
-            screen,
-            {
-                c: chunks[c]
-                for c in chunks_around(pos, h=chunks_h, w=chunks_w)
-                if c in chunks
-            },
-            animations,
-            pos,
-            t=t,
-            s=tile_size,
-            debug=debug,
-        )
+        if tile_size < LOD_TILE_SIZE:
+            blit_thumbnails(
+                screen,
+                thumbnails,
+                view.chunks,
+                pos,
+                s=tile_size,
+                chunk_size=chunk_size,
+            )
+        else:
+            blit(
+                screen,
+                view.chunks,
+                animation_steps,
+                scaled_tiles,
+                pos,
+                t=t,
+                s=tile_size,
+                chunk_size=chunk_size,
+            )
+
+        if show_minimap:
+            blit_minimap(
+                screen, thumbnails, pos, s=tile_size, chunk_size=chunk_size
+            )
+
+        profiler.lap("world")
 
         if debug:
+            blit_debug_grid(
+                screen,
+                font,
+                view.chunks,
+                pos,
+                s=tile_size,
+                chunk_size=chunk_size,
+            )
             _, h = screen.get_size()
             blit_debug_pannel(
                 screen, font, clock, chunks, chunks_to_load, pos=(10, h - 10)
             )
+            blit_profiler(
+                screen,
+                font,
+                profiler,
+                pos=(10, 10),
+                budget=1000 / args.frame_rate,
+            )
+
+        profiler.lap("debug")
 
         pygame.display.flip()
+
+        profiler.lap("flip")
+        profiler.stop()
+
         dt = clock.tick(args.frame_rate) / 1000
 
         t += 1
 
     pygame.quit()
+    screenshots.close()
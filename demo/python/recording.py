@@ -0,0 +1,250 @@
+import pygame
+import sys
+import numpy as np
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, Tuple
+from PIL import Image, GifImagePlugin
+
+# PIL raw modes of the pixels of 32-bit surfaces, from their RGB masks
+RAWMODES = {
+    (0xff0000, 0x00ff00, 0x0000ff): "BGRX",
+    (0x0000ff, 0x00ff00, 0xff0000): "RGBX",
+}
+
+GIF_MAX_COLORS = 256
+UNKNOWN_COLOR = 0xffff
+
+
+def _rawmode(surface: pygame.surface.Surface) -> str | None:
+    masks = tuple(surface.get_masks()[:3])
+    if (
+        sys.byteorder == "little"
+        and surface.get_bytesize() == 4
+        and masks in RAWMODES
+    ):
+        return RAWMODES[masks]
+    return None
+
+
+def surface_to_image(surface: pygame.surface.Surface) -> Image.Image:
+    rawmode = _rawmode(surface)
+    if rawmode is not None:
+        # decode the pixels in place, without transposing a copy of them
+        return Image.frombuffer(
+            "RGB",
+            surface.get_size(),
+            surface.get_buffer(),
+            "raw",
+            rawmode,
+            surface.get_pitch(),
+            1,
+        )
+    return Image.frombytes(
+        "RGB", surface.get_size(), pygame.image.tobytes(surface, "RGB")
+    )
+
+
+# saves surfaces as images in a background thread, so that encoding them
+# doesn't hold the frame in which they're taken
+#
+# the pixels are copied as they are in the surface, a single copy of its
+# buffer, and only decoded and encoded by the thread, one image at a time, in
+# the order they were taken
+class ScreenshotWriter:
+    def __init__(self, on_saved: Callable[[str], None] | None = None):
+        self.on_saved = on_saved
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="screenshot"
+        )
+
+    def save(self, surface: pygame.surface.Surface, path: str) -> Future:
+        size, rawmode = surface.get_size(), _rawmode(surface)
+        if rawmode is not None:
+            pixels, pitch = surface.get_buffer().raw, surface.get_pitch()
+        else:
+            pixels, rawmode, pitch = pygame.image.tobytes(surface, "RGB"), "RGB", 0
+        return self._executor.submit(self._save, path, size, pixels, rawmode, pitch)
+
+    def _save(
+        self, path: str, size: (int, int), pixels: bytes, rawmode: str, pitch: int
+    ):
+        Image.frombuffer("RGB", size, pixels, "raw", rawmode, pitch, 1).save(path)
+        if self.on_saved is not None:
+            self.on_saved(path)
+
+    # waits for the images which are still being saved
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self) -> "ScreenshotWriter":
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+# a palette image with all the colors of the given surfaces, e.g. the tiles
+# which will be drawn, as they appear once drawn on top of the background,
+# reduced to the GIF limit, the most frequent colors first, if there are too
+# many of them
+def tileset_palette(
+    surfaces: List[pygame.surface.Surface], background: Tuple[int, int, int]
+) -> Image.Image:
+    pixels = [np.array([background], dtype=np.uint8)]
+    for surface in surfaces:
+        canvas = pygame.Surface(surface.get_size())
+        canvas.fill(background)
+        canvas.blit(surface, (0, 0))
+        pixels.append(np.frombuffer(
+            pygame.image.tobytes(canvas, "RGB"), dtype=np.uint8
+        ).reshape(-1, 3))
+    pixels = np.concatenate(pixels)
+
+    # colors packed into integers are sorted by a plain sort, in the same
+    # order as the rows of their channels
+    packed = pixels.astype(np.uint32) @ np.array([1 << 16, 1 << 8, 1], dtype=np.uint32)
+    packed, counts = np.unique(packed, return_counts=True)
+    colors = np.stack(
+        [packed >> 16, (packed >> 8) & 0xff, packed & 0xff], axis=1
+    ).astype(np.uint8)
+    colors = colors[np.argsort(-counts, kind="stable")]
+    if len(colors) > GIF_MAX_COLORS:
+        return Image.fromarray(pixels.reshape(1, -1, 3), "RGB").quantize(
+            GIF_MAX_COLORS, method=Image.Quantize.MEDIANCUT
+        )
+
+    palette = Image.new("P", (1, 1))
+    palette.putpalette(colors.flatten().tobytes())
+    return palette
+
+
+# writes an animated GIF frame by frame, with a single global palette, instead
+# of holding every frame in memory until the end
+#
+# only the last frame is kept around, to merge identical consecutive frames
+# into a longer one and to only encode the pixels which changed since the
+# previous frame, the others being transparent
+class GifWriter:
+    def __init__(
+        self, path: str, palette: Image.Image, duration: float, loop: int = 0
+    ):
+        self.path = path
+        self.palette = palette
+        self.duration = duration
+        self.loop = loop
+        self.nb_frames = 0
+
+        self._colors = np.array(palette.getpalette(), dtype=np.uint32).reshape(-1, 3)
+        self._transparency = None
+        self._palette = palette.getpalette()
+        if len(self._colors) < GIF_MAX_COLORS:
+            # an extra entry which no frame uses
+            self._transparency = len(self._colors)
+            self._palette += [0, 0, 0]
+
+        self._keys = {}
+        self._handle = open(path, "wb")
+        self._previous = None
+        self._pending = None
+
+    # maps the pixels of the surface, read in place, to palette indices, when
+    # all of them are exactly in the palette, because PIL only approximates
+    # the nearest palette color
+    #
+    # the 24 bits of the colors of the pixels index a table of the palette
+    # indices, built once per pixel format, with UNKNOWN_COLOR for the colors
+    # which are not in the palette
+    def _quantize(self, surface: pygame.surface.Surface) -> np.ndarray:
+        if surface.get_bytesize() == 4:
+            r, g, b, _ = surface.get_masks()
+            mask = r | g | b
+            shift = (mask & -mask).bit_length() - 1
+            format = (r, g, b)
+            if format not in self._keys and mask >> shift < 1 << 24:
+                keys = np.array(
+                    [
+                        (surface.map_rgb(tuple(c)) & mask) >> shift
+                        for c in self._colors
+                    ],
+                    dtype=np.uint32,
+                )
+                table = np.full(1 << 24, UNKNOWN_COLOR, dtype=np.uint16)
+                # the first of identical colors wins
+                table[keys[::-1]] = np.arange(len(keys), dtype=np.uint16)[::-1]
+                self._keys[format] = table
+
+            if format in self._keys:
+                # looked up column by column, as they are in memory, and only
+                # transposed once they are bytes
+                pixels = (pygame.surfarray.pixels2d(surface) & mask) >> shift
+                indices = self._keys[format][pixels]
+                if (indices != UNKNOWN_COLOR).all():
+                    return indices.astype(np.uint8).T
+
+        return np.asarray(surface_to_image(surface).quantize(
+            palette=self.palette, dither=Image.Dither.NONE
+        ))
+
+    def write(self, surface: pygame.surface.Surface, duration: float | None = None):
+        duration = self.duration if duration is None else duration
+        frame = self._quantize(surface)
+
+        if self._pending is not None:
+            pending, pending_duration = self._pending
+            if np.array_equal(pending, frame):
+                self._pending = (pending, pending_duration + duration)
+                return
+
+        self._flush()
+        self._pending = (frame, duration)
+
+    def _flush(self):
+        if self._pending is None:
+            return
+        frame, duration = self._pending
+        params = {"duration": duration}
+
+        if self._previous is None:
+            (top, bottom), (left, right) = (0, frame.shape[0]), (0, frame.shape[1])
+            data = frame
+        else:
+            changed = frame != self._previous
+            rows = np.flatnonzero(changed.any(axis=1))
+            cols = np.flatnonzero(changed.any(axis=0))
+            top, bottom, left, right = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+            data = frame[top:bottom, left:right]
+            if self._transparency is not None:
+                data = np.where(
+                    changed[top:bottom, left:right], data, self._transparency
+                ).astype(np.uint8)
+                params["transparency"] = self._transparency
+
+        image = Image.fromarray(np.ascontiguousarray(data), "L")
+        image.putpalette(self._palette)
+
+        if self._previous is None:
+            header, _ = GifImagePlugin.getheader(
+                image, info={"loop": self.loop, "duration": duration}
+            )
+            for block in header:
+                self._handle.write(block)
+
+        for block in GifImagePlugin.getdata(
+            image, offset=(int(left), int(top)), **params
+        ):
+            self._handle.write(block)
+
+        self._previous = frame
+        self._pending = None
+        self.nb_frames += 1
+
+    def close(self):
+        self._flush()
+        self._handle.write(b";")
+        self._handle.close()
+
+    def __enter__(self) -> "GifWriter":
+        return self
+
+    def __exit__(self, *_):
+        self.close()
@@ -0,0 +1,282 @@
+import base64
+import json
+import mmap
+import os
+import struct
+import zlib
+import xml.etree.ElementTree as ET
+import numpy as np
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+from tileset import Sheet
+
+TILED_VERSION = "1.10"
+TILED_EDITOR_VERSION = "1.10.0"
+# the first tile of the tileset is 1 in the layers, 0 meaning no tile
+FIRST_GID = 1
+COMPRESSIONS = ["zlib", "zstd"]
+
+CHUNKED_MAP_SUFFIX = ".pwm"
+CHUNKED_MAP_MAGIC = b"PWMP"
+CHUNKED_MAP_VERSION = 1
+CHUNKED_MAP_HEADER = "<4sHHHI"
+CHUNKED_MAP_ENTRY = "<iiQI"
+
+# layers of a map, bottom first, as (h, w) arrays of Tiled global tile ids
+Layers = Dict[str, np.ndarray]
+
+
+def compress(data: bytes, compression: str) -> bytes:
+    if compression == "zlib":
+        return zlib.compress(data)
+    elif compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise Exception("zstd compression requires the zstandard package")
+        return zstandard.ZstdCompressor().compress(data)
+    raise Exception(
+        f"unknown compression {compression}, expected one of {COMPRESSIONS}"
+    )
+
+
+def encode_layer(layer: np.ndarray, compression: str) -> str:
+    data = np.ascontiguousarray(layer, dtype="<u4").tobytes()
+    return base64.b64encode(compress(data, compression)).decode("ascii")
+
+
+# the description of the spritesheet of the tiles in a Tiled map, with the path
+# to the image relative to the map
+def tiled_tileset(sheet: Sheet, directory: Path) -> dict:
+    if sheet.source is None:
+        raise Exception(
+            "Tiled maps need the image of the tileset, which this bundle "
+            "doesn't record, compile it again or load the JSON tileset instead"
+        )
+
+    w, h = sheet.image.get_size()
+    tw, th = sheet.size
+    return {
+        "firstgid": FIRST_GID,
+        "name": Path(sheet.source).stem,
+        "image": os.path.relpath(sheet.source, directory),
+        "imagewidth": w,
+        "imageheight": h,
+        "tilewidth": tw,
+        "tileheight": th,
+        "tilecount": (h // th) * sheet.cols,
+        "columns": sheet.cols,
+        "margin": 0,
+        "spacing": 0,
+    }
+
+
+def write_tmj(
+    path: Path, layers: Layers, sheet: Sheet, compression: str = "zlib"
+):
+    h, w = next(iter(layers.values())).shape
+    tileset = tiled_tileset(sheet, path.parent)
+    tmj = {
+        "type": "map",
+        "version": TILED_VERSION,
+        "tiledversion": TILED_EDITOR_VERSION,
+        "orientation": "orthogonal",
+        "renderorder": "right-down",
+        "infinite": False,
+        "width": w,
+        "height": h,
+        "tilewidth": tileset["tilewidth"],
+        "tileheight": tileset["tileheight"],
+        "compressionlevel": -1,
+        "nextlayerid": len(layers) + 1,
+        "nextobjectid": 1,
+        "tilesets": [tileset],
+        "layers": [
+            {
+                "id": id,
+                "name": name,
+                "type": "tilelayer",
+                "x": 0,
+                "y": 0,
+                "width": w,
+                "height": h,
+                "opacity": 1,
+                "visible": True,
+                "encoding": "base64",
+                "compression": compression,
+                "data": encode_layer(layer, compression),
+            }
+            for id, (name, layer) in enumerate(layers.items(), start=1)
+        ],
+    }
+    with open(path, "w") as handle:
+        json.dump(tmj, handle)
+
+
+def write_tmx(
+    path: Path, layers: Layers, sheet: Sheet, compression: str = "zlib"
+):
+    h, w = next(iter(layers.values())).shape
+    tileset = tiled_tileset(sheet, path.parent)
+    root = ET.Element("map", {
+        "version": TILED_VERSION,
+        "tiledversion": TILED_EDITOR_VERSION,
+        "orientation": "orthogonal",
+        "renderorder": "right-down",
+        "width": str(w),
+        "height": str(h),
+        "tilewidth": str(tileset["tilewidth"]),
+        "tileheight": str(tileset["tileheight"]),
+        "infinite": "0",
+        "nextlayerid": str(len(layers) + 1),
+        "nextobjectid": "1",
+    })
+    element = ET.SubElement(root, "tileset", {
+        k: str(tileset[k])
+        for k in ["firstgid", "name", "tilewidth", "tileheight", "tilecount", "columns"]
+    })
+    ET.SubElement(element, "image", {
+        "source": tileset["image"],
+        "width": str(tileset["imagewidth"]),
+        "height": str(tileset["imageheight"]),
+    })
+    for id, (name, layer) in enumerate(layers.items(), start=1):
+        element = ET.SubElement(root, "layer", {
+            "id": str(id), "name": name, "width": str(w), "height": str(h)
+        })
+        data = ET.SubElement(element, "data", {
+            "encoding": "base64", "compression": compression
+        })
+        data.text = encode_layer(layer, compression)
+
+    ET.ElementTree(root).write(path, encoding="UTF-8", xml_declaration=True)
+
+
+# a map split into square chunks, each compressed on its own and listed in an
+# index at the start of the file, so that a single chunk can be read without
+# decoding the rest of the map
+#
+# | header | layer names, as JSON | index: (i, j, offset, size) per chunk |
+# | zlib chunks... |
+#
+# each chunk holds its (layers, chunk_size, chunk_size) little-endian uint32
+# Tiled global tile ids, chunks can be missing and indices can be negative
+def write_chunked_map(
+    path: Path,
+    chunks: Dict[Tuple[int, int], np.ndarray],
+    names: List[str],
+    chunk_size: int,
+):
+    header = json.dumps(names).encode()
+    entries, blobs = [], []
+    offset = (
+        struct.calcsize(CHUNKED_MAP_HEADER)
+        + len(header)
+        + len(chunks) * struct.calcsize(CHUNKED_MAP_ENTRY)
+    )
+    for (i, j), chunk in sorted(chunks.items()):
+        blob = zlib.compress(np.ascontiguousarray(chunk, dtype="<u4").tobytes())
+        entries.append(struct.pack(CHUNKED_MAP_ENTRY, i, j, offset, len(blob)))
+        blobs.append(blob)
+        offset += len(blob)
+
+    with open(path, "wb") as handle:
+        handle.write(struct.pack(
+            CHUNKED_MAP_HEADER,
+            CHUNKED_MAP_MAGIC,
+            CHUNKED_MAP_VERSION,
+            chunk_size,
+            len(header),
+            len(chunks),
+        ))
+        handle.write(header)
+        for entry in entries:
+            handle.write(entry)
+        for blob in blobs:
+            handle.write(blob)
+
+
+class ChunkedMap:
+    def __init__(self, path: Path):
+        with open(path, "rb") as handle:
+            self.buffer = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (
+            magic, version, self.chunk_size, size, nb_chunks
+        ) = struct.unpack_from(CHUNKED_MAP_HEADER, self.buffer)
+        if magic != CHUNKED_MAP_MAGIC:
+            raise Exception(f"{path} is not a chunked map")
+        if version != CHUNKED_MAP_VERSION:
+            raise Exception(
+                f"{path} has version {version}, expected {CHUNKED_MAP_VERSION}"
+            )
+
+        start = struct.calcsize(CHUNKED_MAP_HEADER)
+        self.layers = json.loads(self.buffer[start:start + size])
+        start += size
+
+        self.index = {}
+        for k in range(nb_chunks):
+            i, j, offset, length = struct.unpack_from(
+                CHUNKED_MAP_ENTRY,
+                self.buffer,
+                start + k * struct.calcsize(CHUNKED_MAP_ENTRY),
+            )
+            self.index[(i, j)] = (offset, length)
+
+    # the (layers, chunk_size, chunk_size) tile ids of a chunk
+    def chunk(self, i: int, j: int) -> np.ndarray:
+        offset, length = self.index[(i, j)]
+        data = zlib.decompress(self.buffer[offset:offset + length])
+        return np.frombuffer(data, dtype="<u4").reshape(
+            len(self.layers), self.chunk_size, self.chunk_size
+        )
+
+    def __contains__(self, chunk: Tuple[int, int]) -> bool:
+        return chunk in self.index
+
+    def __iter__(self) -> Iterator[Tuple[int, int]]:
+        return iter(self.index)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+
+# the whole map in one of the formats, from the suffix of the path, the
+# chunked format splitting it into chunks of `chunk_size` tiles
+def write_map(
+    path: Path,
+    layers: Layers,
+    sheet: Sheet,
+    *,
+    chunk_size: int,
+    compression: str = "zlib",
+):
+    if path.suffix in [".tmj", ".json"]:
+        write_tmj(path, layers, sheet, compression)
+    elif path.suffix == ".tmx":
+        write_tmx(path, layers, sheet, compression)
+    elif path.suffix == CHUNKED_MAP_SUFFIX:
+        stack = np.stack(list(layers.values()))
+        _, h, w = stack.shape
+        ph, pw = -h % chunk_size, -w % chunk_size
+        stack = np.pad(stack, ((0, 0), (0, ph), (0, pw)))
+        write_chunked_map(
+            path,
+            {
+                (i, j): stack[
+                    :,
+                    i * chunk_size:(i + 1) * chunk_size,
+                    j * chunk_size:(j + 1) * chunk_size,
+                ]
+                for i in range((h + ph) // chunk_size)
+                for j in range((w + pw) // chunk_size)
+            },
+            list(layers.keys()),
+            chunk_size,
+        )
+    else:
+        raise Exception(
+            f"unknown map format {path.suffix}, expected .tmj, .tmx or "
+            f"{CHUNKED_MAP_SUFFIX}"
+        )
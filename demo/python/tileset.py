@@ -1,84 +1,378 @@
 import pygame
 import json
-from typing import List, Dict
+import os
+import mmap
+from multiprocessing.shared_memory import SharedMemory
+import struct
+import sys
+import argparse
+import numpy as np
+from typing import List, Dict, Mapping, Iterator, Iterable, Tuple
 from dataclasses import dataclass
-from tqdm import tqdm
+from enum import IntEnum
 from pathlib import Path
 
+BUNDLE_SUFFIX = ".bin"
+BUNDLE_MAGIC = b"PUNY"
+BUNDLE_VERSION = 1
+BUNDLE_ALIGNMENT = 64
 
-@ dataclass
+DIRECTIONS = ['n', 'e', 's', 'w']
+OPPOSITE = {'n': 's', 'e': 'w', 's': 'n', 'w': 'e'}
+
+
+# the sides of a tile, in the order of DIRECTIONS
+class Direction(IntEnum):
+    NORTH = 0
+    EAST = 1
+    SOUTH = 2
+    WEST = 3
+
+
+# the index of a side, from any of the ways callers name it
+DIRECTION_INDEX = {
+    **{d: i for i, d in enumerate(DIRECTIONS)},
+    **{d.name.lower(): d.value for d in Direction},
+    **{d.value: d.value for d in Direction},
+}
+
+
+def info(msg: str):
+    from rich import print
+
+    print(f"[bold green]INFO[/bold green]: {msg}")
+
+
+def warning(msg: str):
+    from rich import print
+
+    print(f"[bold yellow]WARNING[/bold yellow]: {msg}")
+
+
+def cut(
+    surface: pygame.surface.Surface, id: int, /, size: (int, int), cols: int
+) -> pygame.surface.Surface:
+    return surface.subsurface(
+        pygame.Rect(id % cols * size[0], id // cols * size[1], *size)
+    )
+
+
+# a spritesheet which is only decoded the first time one of its tiles is needed
+class Sheet:
+    def __init__(self, source: Path, size: (int, int), cols: int):
+        self.source = source
+        self.size = size
+        self.cols = cols
+        self._image = None
+        self._tiles = {}
+        self._rgba = None
+        self._stack = None
+        self._integral = None
+        self._colors = None
+
+    def _load(self) -> pygame.surface.Surface:
+        return pygame.image.load(self.source)
+
+    @property
+    def image(self) -> pygame.surface.Surface:
+        if self._image is None:
+            self._image = self._load()
+        return self._image
+
+    def cut(self, id: int) -> pygame.surface.Surface:
+        if id not in self._tiles:
+            self._tiles[id] = cut(self.image, id, size=self.size, cols=self.cols)
+        return self._tiles[id]
+
+    # the (h, w, 4) RGBA pixels of the whole sheet
+    @property
+    def rgba(self) -> np.ndarray:
+        if self._rgba is None:
+            self._rgba = np.dstack((
+                pygame.surfarray.array3d(self.image),
+                pygame.surfarray.array_alpha(self.image),
+            )).swapaxes(0, 1)
+        return self._rgba
+
+    # the (rows * cols, tile_h, tile_w, 4) pixels of the tiles, indexed by id
+    @property
+    def stack(self) -> np.ndarray:
+        if self._stack is None:
+            tw, th = self.size
+            rows = self.rgba.shape[0] // th
+            self._stack = (
+                self.rgba[:rows * th, :self.cols * tw]
+                .reshape(rows, th, self.cols, tw, 4)
+                .swapaxes(1, 2)
+                .reshape(rows * self.cols, th, tw, 4)
+            )
+        return self._stack
+
+    # summed-area table of the pixels of the sheet, with their RGB
+    # premultiplied by their alpha, and a leading row and column of zeros, so
+    # that the sum over any rectangle only takes four lookups
+    @property
+    def integral(self) -> np.ndarray:
+        if self._integral is None:
+            rgba = self.rgba.astype(float)
+            rgba[..., :3] *= rgba[..., 3:] / 255
+            h, w, _ = rgba.shape
+            self._integral = np.zeros((h + 1, w + 1, 4))
+            self._integral[1:, 1:] = rgba.cumsum(axis=0).cumsum(axis=1)
+        return self._integral
+
+    # the average premultiplied RGBA color of the (x, y, w, h) rectangles
+    def region_mean(self, rects: np.ndarray) -> np.ndarray:
+        x, y, w, h = np.asarray(rects).T
+        sat = self.integral
+        total = (
+            sat[y + h, x + w] - sat[y, x + w] - sat[y + h, x] + sat[y, x]
+        )
+        return total / (w * h)[..., None]
+
+    # the (rows * cols, 4) average premultiplied RGBA color of the tiles,
+    # indexed by id, i.e. the color of a single pixel standing for a tile
+    @property
+    def colors(self) -> np.ndarray:
+        if self._colors is None:
+            tw, th = self.size
+            ids = np.arange(len(self.stack))
+            self._colors = self.region_mean(np.stack([
+                ids % self.cols * tw,
+                ids // self.cols * th,
+                np.full_like(ids, tw),
+                np.full_like(ids, th),
+            ], axis=1))
+        return self._colors
+
+
+# a spritesheet stored as raw RGBA pixels, e.g. in a memory-mapped bundle,
+# which is wrapped as a surface without any copy, the image it was made from
+# being only kept as its source, if known, for the tools which need the file
+class BufferSheet(Sheet):
+    def __init__(
+        self,
+        buffer: memoryview,
+        shape: (int, int),
+        size: (int, int),
+        cols: int,
+        source: Path | None = None,
+    ):
+        super().__init__(source, size, cols)
+        self.buffer = buffer
+        self.shape = shape
+
+    def _load(self) -> pygame.surface.Surface:
+        h, w = self.shape
+        return pygame.image.frombuffer(self.buffer, (w, h), "RGBA")
+
+
+# tiles are immutable and slotted, there are a lot of them, and their edges are
+# stored as a tuple in the order of DIRECTIONS, the sides being given either by
+# name or all at once as `edges`
+@dataclass(frozen=True, slots=True)
 class Tile:
-    image: pygame.surface.Surface
+    sheet: Sheet
     id: int
-    north: str | None
-    east: str | None
-    west: str | None
-    south: str | None
+    edges: Tuple[str | None, str | None, str | None, str | None]
     transparent: bool
     animation: bool
 
-    def get_type(self, dir: str) -> str | None:
-        if dir == 'n' or dir == "north":
-            return self.north
-        if dir == 'e' or dir == "east":
-            return self.east
-        if dir == 's' or dir == "south":
-            return self.south
-        if dir == 'w' or dir == "west":
-            return self.west
+    def __init__(
+        self,
+        sheet: Sheet,
+        id: int,
+        *,
+        north: str | None = None,
+        east: str | None = None,
+        south: str | None = None,
+        west: str | None = None,
+        transparent: bool = False,
+        animation: bool = False,
+        edges: Tuple[str | None, ...] | None = None,
+    ):
+        object.__setattr__(self, "sheet", sheet)
+        object.__setattr__(self, "id", id)
+        object.__setattr__(
+            self, "edges", tuple(edges or (north, east, south, west))
+        )
+        object.__setattr__(self, "transparent", transparent)
+        object.__setattr__(self, "animation", animation)
 
+    @property
+    def north(self) -> str | None:
+        return self.edges[Direction.NORTH]
 
-@dataclass
+    @property
+    def east(self) -> str | None:
+        return self.edges[Direction.EAST]
+
+    @property
+    def south(self) -> str | None:
+        return self.edges[Direction.SOUTH]
+
+    @property
+    def west(self) -> str | None:
+        return self.edges[Direction.WEST]
+
+    # the edge on a side, as 'n', "north", Direction.NORTH or its index
+    def get_type(self, dir: str | int) -> str | None:
+        index = DIRECTION_INDEX.get(dir)
+        return None if index is None else self.edges[index]
+
+    @property
+    def image(self) -> pygame.surface.Surface:
+        return self.sheet.cut(self.id)
+
+    @property
+    def color(self) -> np.ndarray:
+        return self.sheet.colors[self.id]
+
+
+@dataclass(frozen=True, slots=True)
 class AnimationStep:
     id: int
     duration: int
-    tile: pygame.surface.Surface
+    tile: Tile
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Animation:
     id: int
-    animation: List[AnimationStep]
+    animation: Tuple[AnimationStep, ...]
 
 
 Name = str
 Character = Dict[Name, List[pygame.surface.Surface]]
 
 
-def cut(
-    surface: pygame.surface.Surface, id: int, /, size: (int, int), cols: int
-) -> pygame.surface.Surface:
-    return surface.subsurface(
-        pygame.Rect(id % cols * size[0], id // cols * size[1], *size)
-    )
+# the characters of a tileset, each spritesheet being loaded and cut on first
+# access
+class Characters(Mapping[Name, Character]):
+    def __init__(
+        self,
+        sheets: Dict[Name, Sheet],
+        animations: Dict[Name, Dict[Name, List[int]]],
+    ):
+        self.sheets = sheets
+        self.animations = animations
+        self._loaded = {}
+
+    def __getitem__(self, name: Name) -> Character:
+        if name not in self._loaded:
+            sheet = self.sheets[name]
+            self._loaded[name] = {
+                k: [sheet.cut(i) for i in ids]
+                for k, ids in self.animations[name].items()
+            }
+        return self._loaded[name]
+
+    def __iter__(self) -> Iterator[Name]:
+        return iter(self.sheets)
+
+    def __len__(self) -> int:
+        return len(self.sheets)
+
+
+# every character spritesheet scaled once to the rendering size, the first time
+# it is drawn, with the source rectangle of each (character, animation, frame),
+# so that many characters can be drawn with a single `Surface.blits`
+class CharacterAtlas:
+    def __init__(self, characters: Characters, size: (int, int)):
+        self.size = size
+        self.sheets = characters.sheets
+        self._images = {}
+        self.rects = {}
+        for name, sheet in characters.sheets.items():
+            for k, ids in characters.animations[name].items():
+                self.rects[name, k] = [
+                    pygame.Rect(
+                        id % sheet.cols * size[0],
+                        id // sheet.cols * size[1],
+                        *size,
+                    )
+                    for id in ids
+                ]
+
+    def image(self, name: Name) -> pygame.surface.Surface:
+        if name not in self._images:
+            sheet = self.sheets[name]
+            w, h = sheet.image.get_size()
+            sx, sy = self.size[0] / sheet.size[0], self.size[1] / sheet.size[1]
+            self._images[name] = pygame.transform.scale(
+                sheet.image, (round(w * sx), round(h * sy))
+            )
+        return self._images[name]
+
+    def frames(self, name: Name, animation: Name) -> int:
+        return len(self.rects[name, animation])
+
+    # sprites are given as (character, animation, frame, position), the frame
+    # being wrapped around the length of the animation
+    def blits(
+        self,
+        surface: pygame.surface.Surface,
+        sprites: Iterable[Tuple[Name, Name, int, Tuple[float, float]]],
+    ):
+        surface.blits(
+            [
+                (
+                    self.image(name),
+                    pos,
+                    self.rects[name, k][frame % len(self.rects[name, k])],
+                )
+                for name, k, frame, pos in sprites
+            ],
+            doreturn=False,
+        )
 
 
 def load_tileset(
+    tileset: Path, lazy: bool = True
+) -> (Dict[Name, Tile], List[Animation], Characters):
+    if tileset.suffix == BUNDLE_SUFFIX:
+        tiles, animations, characters = Bundle.from_file(tileset).load()
+    else:
+        tiles, animations, characters = load_metadata(tileset)
+
+    if not lazy:
+        from tqdm import tqdm
+
+        for tile in tqdm(tiles.values(), desc="loading world assets"):
+            tile.image
+        for sheet in {id(t.sheet): t.sheet for t in tiles.values()}.values():
+            sheet.colors
+        for name in tqdm(characters, desc="loading character assets"):
+            characters[name]
+
+    return tiles, animations, characters
+
+
+def load_metadata(
     tileset: Path
-) -> (Dict[Name, Tile], List[Animation], Dict[Name, Character]):
+) -> (Dict[Name, Tile], List[Animation], Characters):
     with open(tileset, 'r') as handle:
         metadata = json.load(handle)
 
     overworld = metadata["overworld"]
 
-    tilewidth = overworld["image"]["tile_width"]
-    tileheight = overworld["image"]["tile_height"]
-    nb_columns = overworld["image"]["columns"]
-    image = pygame.image.load(
-        tileset.parent.joinpath(overworld["image"]["source"])
+    sheet = Sheet(
+        tileset.parent.joinpath(overworld["image"]["source"]),
+        size=(
+            overworld["image"]["tile_width"], overworld["image"]["tile_height"]
+        ),
+        cols=overworld["image"]["columns"],
     )
 
     tiles = {}
-    for k, v in tqdm(overworld["tiles"].items(), desc="loading world assets"):
+    for k, v in overworld["tiles"].items():
         tiles[k] = Tile(
-            image=cut(
-                image, v["id"], size=(tilewidth, tileheight), cols=nb_columns
-            ),
+            sheet=sheet,
             id=v["id"],
             north=v["n"],
             east=v["e"],
-            west=v["w"],
             south=v["s"],
+            west=v["w"],
             transparent=v["transparent"],
             animation=v["animation"],
         )
@@ -86,69 +380,527 @@ def load_tileset(
     animations = [
         Animation(
             id=a["id"],
-            animation=[
+            animation=tuple(
                 AnimationStep(
                     id=b["id"],
                     duration=b["duration"],
                     tile=Tile(
-                        image=cut(
-                            image, b["id"], size=(tilewidth, tileheight), cols=nb_columns
-                        ),
+                        sheet=sheet,
                         id=b["id"],
                         north=None,
                         east=None,
-                        west=None,
                         south=None,
+                        west=None,
                         transparent=False,
                         animation=False,
                     )
                 )
                 for b in a["animation"]
-            ]
+            ),
         )
         for a in overworld["animations"]
     ]
 
-    characters = {}
-    for name, character in tqdm(
-        metadata["characters"].items(),
-        desc="loading character assets",
+    characters = Characters(
+        {
+            name: Sheet(
+                tileset.parent.joinpath(character["image"]["source"]),
+                size=(
+                    character["image"]["tile_width"],
+                    character["image"]["tile_height"],
+                ),
+                cols=character["image"]["columns"],
+            )
+            for name, character in metadata["characters"].items()
+        },
+        {
+            name: character["animations"]
+            for name, character in metadata["characters"].items()
+        },
+    )
+
+    return tiles, animations, characters
+
+
+# an image with one pixel per cell of a grid, from (h, w, 4) layers of
+# premultiplied RGBA colors, e.g. the colors of tiles, the first layer being
+# drawn on top of black and each next one on top of the previous ones
+def minimap(layers: List[np.ndarray]) -> pygame.surface.Surface:
+    pixels = np.zeros(layers[0].shape[:2] + (3,))
+    for layer in layers:
+        pixels = layer[..., :3] + (1 - layer[..., 3:] / 255) * pixels
+    return pygame.surfarray.make_surface(
+        pixels.round().clip(0, 255).astype(np.uint8).swapaxes(0, 1)
+    )
+
+
+# (4, T, T) matrix where [d, a, b] tells if tile b can be placed next to tile a
+# in direction d, directions being ordered as in DIRECTIONS
+def adjacency_matrix(edges: np.ndarray) -> np.ndarray:
+    return np.stack([
+        (edges[:, None, d] == edges[None, :, DIRECTIONS.index(OPPOSITE[dir])])
+        & (edges[:, None, d] >= 0)
+        for d, dir in enumerate(DIRECTIONS)
+    ])
+
+
+@dataclass(frozen=True, slots=True)
+class Neighbours:
+    n: Tuple[Name, ...]
+    e: Tuple[Name, ...]
+    s: Tuple[Name, ...]
+    w: Tuple[Name, ...]
+
+
+# the sorted edge labels of a set of tiles, and the (T, 4) ids of the edges of
+# each tile in the order of DIRECTIONS, -1 for the sides without an edge
+def edge_table(tiles: Dict[Name, Tile]) -> (List[str], np.ndarray):
+    edges = sorted({
+        e for t in tiles.values() for e in map(t.get_type, DIRECTIONS)
+        if e is not None
+    })
+    edge_ids = {e: i for i, e in enumerate(edges)}
+
+    tile_edges = np.array(
+        [
+            [edge_ids.get(t.get_type(d), -1) for d in DIRECTIONS]
+            for t in tiles.values()
+        ],
+        dtype=np.int16,
+    ).reshape(-1, len(DIRECTIONS))
+    return edges, tile_edges
+
+
+# the tiles of a set with dense indices, from 0 in the order of the set, and
+# their attributes as arrays indexed by them, so that hot loops index lists
+# and arrays instead of hashing names, which are only kept to look tiles up
+class TileTable:
+    def __init__(
+        self, tiles: Dict[Name, Tile], weights: Dict[Name, float] | None = None
     ):
-        image = pygame.image.load(
-            tileset.parent.joinpath(character["image"]["source"])
+        self.names = list(tiles.keys())
+        self.index = {k: i for i, k in enumerate(self.names)}
+        self.tiles = list(tiles.values())
+
+        self.ids = np.array([t.id for t in self.tiles], dtype=np.int32)
+        # ids of the labels in `edge_labels`, as (T, 4) in the order of
+        # DIRECTIONS, -1 for the sides without an edge
+        self.edge_labels, self.edges = edge_table(tiles)
+        self.transparent = np.array(
+            [t.transparent for t in self.tiles], dtype=bool
+        )
+        self.animation = np.array([t.animation for t in self.tiles], dtype=bool)
+        # the tiles without a weight have a weight of 1
+        self.weights = np.array(
+            [(weights or {}).get(k, 1.0) for k in self.names], dtype=float
         )
-        size = (
-            character["image"]["tile_width"], character["image"]["tile_height"]
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    # the indices of the tiles with the given names, in the same order
+    def indices(self, names: Iterable[Name]) -> List[int]:
+        names = list(names)
+        unknown = [k for k in names if k not in self.index]
+        if len(unknown) > 0:
+            raise ValueError(f"unknown tiles {unknown}")
+        return [self.index[k] for k in names]
+
+
+# which tiles can be placed next to which, for a whole set at once: the
+# adjacency matrix and, for each tile, its neighbours in every direction, in
+# the order of the set, as `compute_neighbours` gives them
+class Compatibility:
+    def __init__(self, names: List[Name], matrix: np.ndarray):
+        self.names = names
+        self.index = {k: i for i, k in enumerate(names)}
+        self.matrix = matrix
+
+        # the pairs are sorted by tile then by neighbour, so the neighbours of
+        # each tile are a contiguous run
+        runs = []
+        for d in range(len(DIRECTIONS)):
+            a, b = np.nonzero(matrix[d])
+            bounds = np.searchsorted(a, np.arange(len(names) + 1)).tolist()
+            b = b.tolist()
+            runs.append([
+                tuple(names[x] for x in b[bounds[i]:bounds[i + 1]])
+                for i in range(len(names))
+            ])
+        self.neighbours = [
+            Neighbours(*(runs[d][i] for d in range(len(DIRECTIONS))))
+            for i in range(len(names))
+        ]
+
+    @classmethod
+    def from_tiles(cls, tiles: Dict[Name, Tile]) -> "Compatibility":
+        _, tile_edges = edge_table(tiles)
+        return cls(list(tiles.keys()), adjacency_matrix(tile_edges))
+
+    def __getitem__(self, name: Name) -> Neighbours:
+        return self.neighbours[self.index[name]]
+
+    # the matrix with the names of its tiles, as `.npz`, for other tools
+    def save(self, path: Path):
+        np.savez_compressed(
+            path,
+            names=np.array(self.names),
+            directions=np.array(DIRECTIONS),
+            matrix=self.matrix,
         )
-        cols = character["image"]["columns"]
-        characters[name] = {
-            k: [cut(image, i, size=size, cols=cols) for i in ids]
-            for k, ids in character["animations"].items()
+
+    @classmethod
+    def load(cls, path: Path) -> "Compatibility":
+        with np.load(path) as data:
+            if data["directions"].tolist() != DIRECTIONS:
+                raise Exception(
+                    f"{path} has directions {data['directions'].tolist()}, "
+                    f"expected {DIRECTIONS}"
+                )
+            return cls(data["names"].tolist(), data["matrix"])
+
+
+def _align(n: int) -> int:
+    return (n + BUNDLE_ALIGNMENT - 1) // BUNDLE_ALIGNMENT * BUNDLE_ALIGNMENT
+
+
+# layout of a bundle:
+# - magic, version and length of the header, as `<4sII`
+# - the header, as UTF-8 JSON, with names, edge labels, character animations,
+#   the path to the image of the atlas and the offset, dtype and shape of every
+#   section, offsets being relative to the end of the header, aligned on
+#   BUNDLE_ALIGNMENT bytes
+# - the sections, aligned on BUNDLE_ALIGNMENT bytes: tile table, edge label
+#   ids, adjacency bitsets, animation tables and raw RGBA spritesheets
+#
+# the image of the atlas is relative to `directory`, the one the bundle is
+# written in, or absolute without it, e.g. in shared memory
+def pack_tileset(tileset: Path, directory: Path | None = None) -> bytearray:
+    tiles, animations, characters = load_metadata(tileset)
+
+    names = list(tiles.keys())
+    edges, tile_edges = edge_table(tiles)
+
+    sheet = tiles[names[0]].sheet
+
+    def rgba(surface: pygame.surface.Surface) -> np.ndarray:
+        w, h = surface.get_size()
+        return np.frombuffer(
+            pygame.image.tobytes(surface, "RGBA"), dtype=np.uint8
+        ).reshape(h, w, 4)
+
+    sections = {
+        "tile_ids": np.array([t.id for t in tiles.values()], dtype=np.int32),
+        "tile_edges": tile_edges,
+        "tile_flags": np.array(
+            [[t.transparent, t.animation] for t in tiles.values()],
+            dtype=np.uint8,
+        ),
+        "adjacency": np.packbits(adjacency_matrix(tile_edges), axis=-1),
+        "animation_ids": np.array([a.id for a in animations], dtype=np.int32),
+        "animation_offsets": np.cumsum(
+            [0] + [len(a.animation) for a in animations], dtype=np.int32
+        ),
+        "animation_steps": np.array(
+            [[s.id, s.duration] for a in animations for s in a.animation],
+            dtype=np.int32,
+        ).reshape(-1, 2),
+        "atlas": rgba(sheet.image),
+    }
+    for name, s in characters.sheets.items():
+        sections[f"characters/{name}"] = rgba(s.image)
+
+    header = {
+        "names": names,
+        "edges": edges,
+        "tile_size": sheet.size,
+        "columns": sheet.cols,
+        "image": (
+            os.path.relpath(sheet.source, directory)
+            if directory is not None
+            else str(Path(sheet.source).resolve())
+        ),
+        "characters": {
+            name: {
+                "tile_size": s.size,
+                "columns": s.cols,
+                "animations": characters.animations[name],
+            }
+            for name, s in characters.sheets.items()
+        },
+        "sections": {},
+    }
+
+    offset = 0
+    for k, v in sections.items():
+        header["sections"][k] = {
+            "offset": offset, "dtype": v.dtype.str, "shape": list(v.shape)
         }
+        offset = _align(offset + v.nbytes)
 
-    return tiles, animations, characters
+    raw_header = json.dumps(header).encode()
+    start = _align(struct.calcsize("<4sII") + len(raw_header))
 
+    bundle = bytearray(start + offset)
+    struct.pack_into(
+        "<4sII", bundle, 0, BUNDLE_MAGIC, BUNDLE_VERSION, len(raw_header)
+    )
+    offset = struct.calcsize("<4sII")
+    bundle[offset:offset + len(raw_header)] = raw_header
+    for k, v in sections.items():
+        offset = start + header["sections"][k]["offset"]
+        bundle[offset:offset + v.nbytes] = np.ascontiguousarray(v).tobytes()
 
-@dataclass
-class Neighbours:
-    n: List[Name]
-    e: List[Name]
-    s: List[Name]
-    w: List[Name]
+    return bundle
+
+
+def compile_tileset(tileset: Path, output: Path):
+    with open(output, "wb") as handle:
+        handle.write(pack_tileset(tileset, output.parent))
+
+
+# a block of shared memory attached to by a reader, whose surfaces and arrays
+# are views into its buffer and can outlive it, in which case it can't be
+# closed and stays mapped until the process exits
+class AttachedMemory(SharedMemory):
+    def close(self):
+        try:
+            super().close()
+        except BufferError:
+            pass
+
+
+# a compiled tileset on top of any buffer, e.g. a file memory-mapped
+# copy-on-write, so that every process using the same bundle shares the
+# page-cached pixels until it writes to them, or a block of shared memory
+#
+# relative paths in the header are relative to `directory`, the one of the
+# file, and can't be found without it
+class Bundle:
+    def __init__(
+        self, buffer: memoryview, source: str, directory: Path | None = None
+    ):
+        self.buffer = buffer
+        self.directory = directory
+
+        magic, version, size = struct.unpack_from("<4sII", self.buffer)
+        if magic != BUNDLE_MAGIC:
+            raise Exception(f"{source} is not a tileset bundle")
+        if version != BUNDLE_VERSION:
+            raise Exception(
+                f"{source} has bundle version {version}, expected {BUNDLE_VERSION}"
+            )
+
+        start = struct.calcsize("<4sII")
+        self.header = json.loads(bytes(self.buffer[start:start + size]))
+        self.start = _align(start + size)
+
+    @classmethod
+    def from_file(cls, path: Path) -> "Bundle":
+        with open(path, "rb") as handle:
+            buffer = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_COPY)
+        return cls(memoryview(buffer), str(path), path.parent)
+
+    @classmethod
+    def from_shared_memory(cls, name: str) -> "Bundle":
+        if sys.version_info >= (3, 13):
+            shm = AttachedMemory(name=name, track=False)
+        else:
+            shm = AttachedMemory(name=name)
+        bundle = cls(shm.buf.toreadonly(), f"shared memory {name}")
+        bundle.shm = shm
+        return bundle
+
+    def array(self, name: str) -> np.ndarray:
+        section = self.header["sections"][name]
+        dtype = np.dtype(section["dtype"])
+        return np.frombuffer(
+            self.buffer,
+            dtype=dtype,
+            count=int(np.prod(section["shape"])),
+            offset=self.start + section["offset"],
+        ).reshape(section["shape"])
+
+    def sheet(
+        self, name: str, size: (int, int), cols: int, source: Path | None = None
+    ) -> BufferSheet:
+        section = self.header["sections"][name]
+        h, w, c = section["shape"]
+        offset = self.start + section["offset"]
+        buffer = self.buffer[offset:offset + h * w * c]
+        return BufferSheet(
+            buffer, (h, w), size=tuple(size), cols=cols, source=source
+        )
+
+    # the image of the atlas, bundles compiled before it was recorded having
+    # none
+    def image(self) -> Path | None:
+        image = self.header.get("image")
+        if image is None:
+            return None
+        if Path(image).is_absolute():
+            return Path(image)
+        if self.directory is None:
+            return None
+        return self.directory / image
+
+    def adjacency(self) -> np.ndarray:
+        nb_tiles = len(self.header["names"])
+        return np.unpackbits(
+            self.array("adjacency"), axis=-1, count=nb_tiles
+        ).astype(bool)
+
+    def compatibility(self) -> Compatibility:
+        return Compatibility(self.header["names"], self.adjacency())
+
+    def load(self) -> (Dict[Name, Tile], List[Animation], Characters):
+        sheet = self.sheet(
+            "atlas",
+            self.header["tile_size"],
+            self.header["columns"],
+            source=self.image(),
+        )
+        edges = self.header["edges"]
+
+        tiles = {}
+        for name, id, tile_edges, (transparent, animation) in zip(
+            self.header["names"],
+            self.array("tile_ids").tolist(),
+            self.array("tile_edges").tolist(),
+            self.array("tile_flags").tolist(),
+        ):
+            n, e, s, w = [edges[x] if x >= 0 else None for x in tile_edges]
+            tiles[name] = Tile(
+                sheet=sheet,
+                id=id,
+                north=n,
+                east=e,
+                south=s,
+                west=w,
+                transparent=bool(transparent),
+                animation=bool(animation),
+            )
+
+        offsets = self.array("animation_offsets").tolist()
+        steps = self.array("animation_steps").tolist()
+        animations = [
+            Animation(
+                id=id,
+                animation=tuple(
+                    AnimationStep(
+                        id=b,
+                        duration=duration,
+                        tile=Tile(
+                            sheet=sheet,
+                            id=b,
+                            north=None,
+                            east=None,
+                            south=None,
+                            west=None,
+                            transparent=False,
+                            animation=False,
+                        ),
+                    )
+                    for b, duration in steps[offsets[i]:offsets[i + 1]]
+                ),
+            )
+            for i, id in enumerate(self.array("animation_ids").tolist())
+        ]
+
+        characters = Characters(
+            {
+                name: self.sheet(
+                    f"characters/{name}", c["tile_size"], c["columns"]
+                )
+                for name, c in self.header["characters"].items()
+            },
+            {
+                name: c["animations"]
+                for name, c in self.header["characters"].items()
+            },
+        )
+
+        return tiles, animations, characters
 
 
 def compute_neighbours(tile: Tile, tiles: Dict[Name, Tile]) -> Neighbours:
     return Neighbours(
-        n=[k for k, v in tiles.items() if v.south == tile.north and tile.north is not None],
-        e=[k for k, v in tiles.items() if v.west == tile.east and tile.east is not None],
-        s=[k for k, v in tiles.items() if v.north == tile.south and tile.south is not None],
-        w=[k for k, v in tiles.items() if v.east == tile.west and tile.west is not None],
+        n=tuple(k for k, v in tiles.items() if v.south == tile.north and tile.north is not None),
+        e=tuple(k for k, v in tiles.items() if v.west == tile.east and tile.east is not None),
+        s=tuple(k for k, v in tiles.items() if v.north == tile.south and tile.south is not None),
+        w=tuple(k for k, v in tiles.items() if v.east == tile.west and tile.west is not None),
+    )
+
+
+# the tiles of a set which can actually be placed, with their neighbours among
+# them
+#
+# a tile needs at least one neighbour in every direction, the ones without are
+# pruned, which can leave others without neighbours, and so on until there is
+# nothing left to prune, so tiles which could only appear on the edges of a map
+# are pruned as well
+@dataclass
+class TilesetAnalysis:
+    # the tiles which are left, in the order of the set
+    names: List[Name]
+    # the pruned tiles, in the order in which they were pruned
+    dead: List[Name]
+    # the (direction, edge) pairs which no tile of the set matches, with the
+    # tiles which have them
+    unreachable: Dict[Tuple[str, str], List[Name]]
+    neighbours: Dict[Name, Neighbours]
+
+
+def analyze_tileset(tiles: Dict[Name, Tile]) -> TilesetAnalysis:
+    compatibility = Compatibility.from_tiles(tiles)
+    neighbours = dict(zip(compatibility.names, compatibility.neighbours))
+
+    unreachable = {}
+    for k, t in tiles.items():
+        for d in DIRECTIONS:
+            edge = t.get_type(d)
+            if edge is not None and len(getattr(neighbours[k], d)) == 0:
+                unreachable.setdefault((d, edge), []).append(k)
+
+    # the number of neighbours left of each tile in each direction, decreased
+    # as tiles are pruned, neighbourhood being symmetric
+    support = {
+        k: {d: len(getattr(n, d)) for d in DIRECTIONS}
+        for k, n in neighbours.items()
+    }
+    dead = [k for k in tiles if 0 in support[k].values()]
+    pruned = set(dead)
+    stack = list(dead)
+    while len(stack) > 0:
+        k = stack.pop()
+        for d in DIRECTIONS:
+            for other in getattr(neighbours[k], OPPOSITE[d]):
+                if other in pruned:
+                    continue
+                support[other][d] -= 1
+                if support[other][d] == 0:
+                    pruned.add(other)
+                    dead.append(other)
+                    stack.append(other)
+
+    names = [k for k in tiles if k not in pruned]
+    return TilesetAnalysis(
+        names=names,
+        dead=dead,
+        unreachable=unreachable,
+        neighbours={
+            k: Neighbours(**{
+                d: tuple(x for x in getattr(neighbours[k], d) if x not in pruned)
+                for d in DIRECTIONS
+            })
+            for k in names
+        },
     )
 
 
 def get_animation_steps(
     id: int, animations: List[Animation]
-) -> List[AnimationStep]:
+) -> Tuple[AnimationStep, ...]:
     matches = [x for x in animations if x.id == id]
     if len(matches) != 1:
         raise Exception(
@@ -164,3 +916,90 @@ def get_tile(id: int, tiles: Dict[Name, Tile]) -> Tile:
             f"there should be exactly one animation with ID {id}, found {len(matches)}"
         )
     return matches[0]
+
+
+# decodes a tileset once, JSON or bundle, and publishes it into shared memory,
+# where worker processes started by the caller can attach to it with
+# `attach_tileset`
+#
+# the image of the atlas of a bundle is relative to its file, which workers
+# don't know about, so they can only export Tiled maps from a published JSON
+# tileset
+#
+# the caller owns the block and should `close` and `unlink` it once the
+# workers are done
+def publish_tileset(tileset: Path, name: str | None = None) -> SharedMemory:
+    if tileset.suffix == BUNDLE_SUFFIX:
+        bundle = tileset.read_bytes()
+    else:
+        bundle = pack_tileset(tileset)
+
+    shm = SharedMemory(name=name, create=True, size=len(bundle))
+    shm.buf[:len(bundle)] = bundle
+    return shm
+
+
+# attaches read-only to a tileset published with `publish_tileset`, tiles,
+# animations and characters are given by `.load()` and the adjacency tables by
+# `.adjacency()`, all of them being views into the shared block
+#
+# before Python 3.13, attaching registers the block with the resource tracker
+# of the process, which unlinks it when it stops: workers started by the
+# publisher with `multiprocessing` share its tracker, so the block lives until
+# the publisher unlinks it, but it's unlinked as soon as an unrelated process
+# which attached to it exits
+def attach_tileset(name: str) -> Bundle:
+    return Bundle.from_shared_memory(name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="compile a JSON tileset into a binary bundle"
+    )
+    parser.add_argument("tileset", type=Path)
+    parser.add_argument("--output", "-o", type=Path)
+    parser.add_argument(
+        "--compatibility",
+        type=Path,
+        help="export the adjacency matrix of the tiles, as .npz, instead",
+    )
+    parser.add_argument(
+        "--analyze",
+        action="store_true",
+        help="report the tiles which can never be placed instead",
+    )
+    args = parser.parse_args()
+
+    if args.analyze:
+        tiles, _, _ = load_tileset(args.tileset)
+        analysis = analyze_tileset(tiles)
+        for (d, edge), names in sorted(analysis.unreachable.items()):
+            warning(
+                f"no tile matches edge {edge!r} of {len(names)} tiles on side {d}"
+            )
+        if len(analysis.dead) > 0:
+            warning(
+                f"{len(analysis.dead)} / {len(tiles)} tiles can never be placed"
+            )
+            for name in analysis.dead:
+                print(f"    {name}")
+        else:
+            info(f"all {len(tiles)} tiles can be placed")
+        sys.exit(0)
+
+    if args.compatibility is not None:
+        if args.tileset.suffix == BUNDLE_SUFFIX:
+            compatibility = Bundle.from_file(args.tileset).compatibility()
+        else:
+            tiles, _, _ = load_tileset(args.tileset)
+            compatibility = Compatibility.from_tiles(tiles)
+        compatibility.save(args.compatibility)
+        info(
+            f"compatibility of {len(compatibility.names)} tiles written in "
+            f"{args.compatibility}"
+        )
+        sys.exit(0)
+
+    output = args.output or args.tileset.with_suffix(BUNDLE_SUFFIX)
+    compile_tileset(args.tileset, output)
+    info(f"bundle written in {output}")
@@ -1,13 +1,25 @@
 import pygame
 from pathlib import Path
-from tileset import load_tileset
-from random import choice
-from typing import List
+from tilemap import write_map, FIRST_GID
+from tileset import (
+    load_tileset,
+    analyze_tileset,
+    minimap,
+    Tile,
+    TileTable,
+    TilesetAnalysis,
+    DIRECTIONS,
+)
+from random import Random
+from typing import List, Dict, Iterable, Iterator, Set, Tuple
+from functools import lru_cache
+from dataclasses import dataclass, field
 import argparse
+import json
+import os
 import numpy as np
 from time import time_ns
-from PIL import Image
-from rich import print
+from recording import ScreenshotWriter
 
 BLACK = (0, 0, 0)
 WHITE = (255, 255, 255)
@@ -15,6 +27,15 @@ RED = (255, 0, 0)
 DARK_GREY = (100, 100, 100)
 GREEN = (0, 255, 0)
 
+# size, in pixels, of a cell of the grid on the minimap
+MINIMAP_SCALE = 2
+# number of scaled average tiles and entropy labels kept around between frames
+PREVIEW_CACHE_SIZE = 1024
+# number of collapses between two checkpoints of a generation
+CHECKPOINT_EVERY = 1000
+# size of the chunks of maps exported in the chunked format
+EXPORT_CHUNK_SIZE = 16
+
 TILE_SUBSET = [
     ("grass_1", 1),
     ("grass_2", .1),
@@ -166,14 +187,20 @@ TILE_SUBSET = [
 
 
 def error(msg: str):
+    from rich import print
+
     print(f"[bold red]ERROR[/bold red]: {msg}")
 
 
 def info(msg: str):
+    from rich import print
+
     print(f"[bold green]INFO[/bold green]: {msg}")
 
 
 def warning(msg: str):
+    from rich import print
+
     print(f"[bold yellow]WARNING[/bold yellow]: {msg}")
 
 
@@ -191,10 +218,30 @@ def handle_events() -> (bool, bool, bool):
     return (True, False, False)
 
 
-def show(cells: List[dict], s: int, show_average_of_tile: bool, min_entropy: float | None):
-    screen.fill(BLACK)
+def show(
+    cells: List[dict],
+    s: int,
+    show_average_of_tile: bool,
+    min_entropy: float | None,
+    show_minimap: bool = False,
+    dirty: Set[int] | None = None,
+):
+    # only the cells which changed are drawn again, on top of the previous
+    # frame, when they are known
+    if dirty is None:
+        screen.fill(BLACK)
+        redraw = cells
+    else:
+        redraw = [cells[n] for n in sorted(dirty)]
+
+    rects = []
+    for c in redraw:
+        rect = pygame.Rect(c["j"] * s, c["i"] * s, s, s)
+        if dirty is not None:
+            screen.set_clip(rect)
+            screen.fill(BLACK, rect)
+            rects.append(rect)
 
-    for c in cells:
         if c["is_collapsed"]:
             if len(c["options"]) == 0:
                 pygame.draw.rect(
@@ -206,7 +253,7 @@ def show(cells: List[dict], s: int, show_average_of_tile: bool, min_entropy: flo
             else:
                 screen.blit(
                     pygame.transform.scale(
-                        tiles[c["options"][0]].image,
+                        table.tiles[c["options"][0]].image,
                         (s, s),
                     ),
                     (c["j"] * s, c["i"] * s),
@@ -214,10 +261,7 @@ def show(cells: List[dict], s: int, show_average_of_tile: bool, min_entropy: flo
         else:
             if len(c["options"]) > 0 and show_average_of_tile:
                 screen.blit(
-                    pygame.transform.scale(
-                        average_images([tiles[opt].image for opt in c["options"]]),
-                        (s, s),
-                    ),
+                    average_preview(tuple(c["options"]), s),
                     (c["j"] * s, c["i"] * s),
                 )
             if c["entropy"] == 0:
@@ -229,7 +273,7 @@ def show(cells: List[dict], s: int, show_average_of_tile: bool, min_entropy: flo
             else:
                 color = DARK_GREY
 
-            text = font.render(str(round(c["entropy"], 1)), False, color)
+            text = entropy_text(round(c["entropy"], 1), color)
             screen.blit(
                 text,
                 (
@@ -238,62 +282,418 @@ def show(cells: List[dict], s: int, show_average_of_tile: bool, min_entropy: flo
                 ),
             )
 
-    pygame.display.flip()
+    screen.set_clip(None)
+
+    if show_minimap and len(cells) > 0:
+        rects.append(blit_minimap(cells))
+
+    if dirty is None:
+        pygame.display.flip()
+    else:
+        pygame.display.update(rects)
+
+
+# most cells share the same options, especially around the start of a
+# generation, so their scaled averages are only computed once per set of
+# options
+@lru_cache(maxsize=PREVIEW_CACHE_SIZE)
+def average_preview(options: Tuple[int, ...], s: int) -> pygame.surface.Surface:
+    return pygame.transform.scale(
+        average_tiles([table.tiles[opt] for opt in options]), (s, s)
+    )
+
+
+@lru_cache(maxsize=PREVIEW_CACHE_SIZE)
+def entropy_text(entropy: float, color: (int, int, int)) -> pygame.surface.Surface:
+    return font.render(str(entropy), False, color)
+
+
+# the grid with one pixel per cell, scaled up MINIMAP_SCALE times, in the
+# bottom right corner of the window, undecided cells having the average color
+# of their options
+def blit_minimap(cells: List[dict]) -> pygame.Rect:
+    h, w = cells[-1]["i"] + 1, cells[-1]["j"] + 1
+    tile_colors = table.tiles[0].sheet.colors[table.ids]
+    colors = np.zeros((h, w, 4))
+    for c in cells:
+        if len(c["options"]) > 0:
+            colors[c["i"], c["j"]] = tile_colors[c["options"]].mean(axis=0)
+
+    image = pygame.transform.scale_by(minimap([colors]), MINIMAP_SCALE)
+    pygame.draw.rect(image, DARK_GREY, image.get_rect(), width=1)
+    sw, sh = screen.get_size()
+    return screen.blit(
+        image, (sw - image.get_width() - 10, sh - image.get_height() - 10)
+    )
+
+
+# tiles are given by their index in the TileTable of the solver
+@dataclass
+class Collapsed:
+    i: int
+    j: int
+    tile: int
+
+
+@dataclass
+class Removed:
+    i: int
+    j: int
+    options: List[int]
+
+
+@dataclass
+class Contradiction:
+    i: int
+    j: int
+
+
+Event = Collapsed | Removed | Contradiction
+
+
+# cells fixed before a generation starts, e.g. to stitch a generated region to
+# its surroundings
+@dataclass
+class Constraints:
+    # the tile of some cells, by (i, j)
+    pins: Dict[Tuple[int, int], str] = field(default_factory=dict)
+    # the tiles some cells are restricted to, by (i, j)
+    domains: Dict[Tuple[int, int], List[str]] = field(default_factory=dict)
+    # the tiles the cells on the edges of the grid are restricted to
+    border: List[str] | None = None
+
+
+# the compact state of a solver, with the options of each cell as a bitset over
+# the tiles, which can be written to disk and restored later on
+@dataclass
+class Snapshot:
+    h: int
+    w: int
+    options: np.ndarray
+    collapsed: np.ndarray
+    random: tuple
+
+    # the file is replaced at once, so that a run killed while saving leaves
+    # the previous checkpoint untouched
+    def save(self, path: Path):
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "wb") as handle:
+            np.savez_compressed(
+                handle,
+                shape=np.array([self.h, self.w, self.options.shape[1]]),
+                options=np.packbits(self.options, axis=1),
+                collapsed=self.collapsed,
+                random=np.array(json.dumps(self.random)),
+            )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path) -> "Snapshot":
+        with np.load(path) as data:
+            h, w, nb_tiles = data["shape"].tolist()
+            version, state, gauss = json.loads(data["random"].item())
+            return cls(
+                h=h,
+                w=w,
+                options=np.unpackbits(
+                    data["options"], axis=1, count=nb_tiles
+                ).astype(bool),
+                collapsed=data["collapsed"],
+                random=(version, tuple(state), gauss),
+            )
+
+
+# the state of a generation, which goes forward one collapse at a time, as
+# cells in the same format as `show()` expects, their options being the
+# indices of the tiles in `table`
+#
+# `step()` collapses the cell with the least entropy and propagates its
+# constraints, returning what happened as events, `run()` streams them until
+# the grid is complete or inconsistent
+class Solver:
+    def __init__(
+        self,
+        table: TileTable,
+        w: int,
+        h: int,
+        use_information_entropy: bool = False,
+        seed: int | None = None,
+        analysis: TilesetAnalysis | None = None,
+    ):
+        self.table = table
+        self.names = table.names
+        self.weights = table.weights.tolist()
+        # tiles which can never be placed are left out from the start, and the
+        # neighbours of the others are looked up instead of their edges
+        self.analysis = analysis or analyze_tileset(
+            dict(zip(table.names, table.tiles))
+        )
+        self.compatible = {d: [set() for _ in table.names] for d in DIRECTIONS}
+        for k, n in self.analysis.neighbours.items():
+            for d in DIRECTIONS:
+                self.compatible[d][table.index[k]] = set(
+                    table.indices(getattr(n, d))
+                )
+        options = table.indices(self.analysis.names)
+        self.w = w
+        self.h = h
+        self.use_information_entropy = use_information_entropy
+        self.random = Random(seed)
+
+        self.cells = [
+            {
+                "i": i,
+                "j": j,
+                "options": list(options),
+                "is_collapsed": False,
+                "entropy": None,
+            }
+            for i in range(h) for j in range(w)
+        ]
+        for c in self.cells:
+            c["entropy"] = self.entropy(c["options"])
+
+        self.remaining = len(self.cells)
+        self.min_entropy = None
+        self.contradiction = None
+
+    @property
+    def done(self) -> bool:
+        return self.remaining == 0 or self.contradiction is not None
+
+    @property
+    def solved(self) -> bool:
+        return self.remaining == 0 and self.contradiction is None
+
+    def entropy(self, options: List[int]) -> float:
+        if not self.use_information_entropy:
+            return len(options)
+        p = self.table.weights[options]
+        p = p / p.sum()
+        return -np.log2(p).sum()
+
+    def step(self) -> List[Event]:
+        if self.done:
+            return []
+
+        # pick non-collapsed cell with least entropy
+        non_collapsed = [c for c in self.cells if not c["is_collapsed"]]
+        self.min_entropy = min(c["entropy"] for c in non_collapsed)
+        cell = self.random.choice(
+            [c for c in non_collapsed if c["entropy"] == self.min_entropy]
+        )
+        return self.collapse(cell)
+
+    def run(self) -> Iterator[Event]:
+        while not self.done:
+            yield from self.step()
+
+    def collapse(self, cell: dict) -> List[Event]:
+        assert len(cell["options"]) > 0, "cell shouldn't be inconsistent"
+
+        tile = self.random.choices(
+            cell["options"], weights=[self.weights[opt] for opt in cell["options"]]
+        )[0]
+        cell["options"] = [tile]
+        cell["is_collapsed"] = True
+        cell["entropy"] = 0
+        self.remaining -= 1
+
+        return [Collapsed(cell["i"], cell["j"], tile)] + self.propagate([cell])
 
+    # removes the options of the neighbours of the cells which are not
+    # compatible with them anymore, and so on until nothing changes
+    def propagate(self, stack: List[dict]) -> List[Event]:
+        w, h, cells = self.w, self.h, self.cells
+        events = []
+        while len(stack) > 0:
+            curr = stack.pop()
+            i, j = curr["i"], curr["j"]
+            for ni, nj, dir in [
+                (i - 1, j, 'n'),
+                (i + 1, j, 's'),
+                (i, j - 1, 'w'),
+                (i, j + 1, 'e'),
+            ]:
+                if 0 <= ni < h and 0 <= nj < w:
+                    n = ni * w + nj
+                    if cells[n]["entropy"] == 0:
+                        continue
 
-def entropy(cell: dict) -> float:
-    p = np.array([weights[opt] for opt in cell["options"]])
-    p = p / p.sum()
-    return -np.log2(p).sum()
+                    before = cells[n]["options"]
+                    compatible = self.compatible[dir]
+                    allowed = set().union(
+                        *(compatible[opt] for opt in curr["options"])
+                    )
+                    options = [opt for opt in before if opt in allowed]
 
+                    cells[n]["options"] = options
+                    if len(options) < len(before):
+                        stack.append(cells[n])
+                        kept = set(options)
+                        events.append(Removed(
+                            ni, nj, [opt for opt in before if opt not in kept]
+                        ))
 
-def collapse(
-    cell: dict, cells: List[dict], w: int, h: int, use_information_entropy: bool
-) -> (bool, int, int):
-    assert len(cell["options"]) > 0, "cell shouldn't be inconsistent"
+                    cells[n]["entropy"] = self.entropy(options)
 
-    p = np.array([weights[opt] for opt in cell["options"]])
-    p = p / p.sum()
-    cell["options"] = np.random.choice(cell["options"], 1, p=p)
-    cell["is_collapsed"] = True
-    cell["entropy"] = 0
+                    if len(options) == 0:
+                        self.contradiction = (ni, nj)
+                        events.append(Contradiction(ni, nj))
+                        return events
 
-    stack = [cell]
-    while len(stack) > 0:
-        curr = stack.pop()
-        i, j = curr["i"], curr["j"]
-        for ni, nj, dir, opposite in [
-            (i - 1, j, 'n', 's'),
-            (i + 1, j, 's', 'n'),
-            (i, j - 1, 'w', 'e'),
-            (i, j + 1, 'e', 'w'),
+        return events
+
+    # keeps only the given tiles, by name, in the options of the cell, without
+    # propagating
+    def restrict(self, i: int, j: int, options: Iterable[str]) -> List[Event]:
+        allowed = set(self.table.indices(options))
+
+        cell = self.cells[i * self.w + j]
+        before = cell["options"]
+        cell["options"] = [opt for opt in before if opt in allowed]
+        if len(cell["options"]) == len(before):
+            return []
+
+        events = [Removed(i, j, [opt for opt in before if opt not in allowed])]
+        if not cell["is_collapsed"]:
+            cell["entropy"] = self.entropy(cell["options"])
+        if len(cell["options"]) == 0:
+            self.contradiction = (i, j)
+            events.append(Contradiction(i, j))
+        return events
+
+    # sets the tile of the cell, without propagating
+    def pin(self, i: int, j: int, tile: str) -> List[Event]:
+        events = self.restrict(i, j, [tile])
+        cell = self.cells[i * self.w + j]
+        if len(cell["options"]) > 0 and not cell["is_collapsed"]:
+            cell["is_collapsed"] = True
+            cell["entropy"] = 0
+            self.remaining -= 1
+            events.append(Collapsed(i, j, cell["options"][0]))
+        return events
+
+    # checks that the tile of a collapsed cell is compatible with the ones of
+    # its collapsed neighbours, a contradiction in the cell otherwise
+    def check_collapsed(self, i: int, j: int) -> List[Event]:
+        cell = self.cells[i * self.w + j]
+        if not cell["is_collapsed"] or len(cell["options"]) == 0:
+            return []
+
+        tile = cell["options"][0]
+        for ni, nj, dir in [
+            (i - 1, j, 'n'),
+            (i + 1, j, 's'),
+            (i, j - 1, 'w'),
+            (i, j + 1, 'e'),
         ]:
-            if 0 <= ni < h and 0 <= nj < w:
-                n = ni * w + nj
-                if cells[n]["entropy"] == 0:
-                    continue
+            if 0 <= ni < self.h and 0 <= nj < self.w:
+                other = self.cells[ni * self.w + nj]
+                if (
+                    other["is_collapsed"]
+                    and len(other["options"]) > 0
+                    and other["options"][0] not in self.compatible[dir][tile]
+                ):
+                    self.contradiction = (i, j)
+                    return [Contradiction(i, j)]
+        return []
+
+    # the problems of constraints which do not even fit the grid or the tiles
+    def invalid(self, constraints: "Constraints") -> List[str]:
+        problems = []
+        outside = sorted({
+            (i, j)
+            for i, j in [*constraints.pins, *constraints.domains]
+            if not (0 <= i < self.h and 0 <= j < self.w)
+        })
+        if len(outside) > 0:
+            problems.append(
+                f"cells {outside} are outside of the {self.w}x{self.h} grid"
+            )
+
+        names = [
+            *constraints.pins.values(),
+            *(k for v in constraints.domains.values() for k in v),
+            *(constraints.border or []),
+        ]
+        unknown = sorted({k for k in names if k not in self.table.index})
+        if len(unknown) > 0:
+            problems.append(f"unknown tiles {unknown}")
+        return problems
+
+    # applies all the constraints first, and then propagates them in a single
+    # pass, before any cell is collapsed
+    def constrain(self, constraints: "Constraints") -> List[Event]:
+        problems = self.invalid(constraints)
+        if len(problems) > 0:
+            raise ValueError(", ".join(problems))
+
+        events = []
+        if constraints.border is not None:
+            for c in self.cells:
+                if c["i"] in (0, self.h - 1) or c["j"] in (0, self.w - 1):
+                    events += self.restrict(c["i"], c["j"], constraints.border)
+        for (i, j), options in constraints.domains.items():
+            events += self.restrict(i, j, options)
+        for (i, j), tile in constraints.pins.items():
+            events += self.pin(i, j, tile)
+
+        if self.contradiction is not None:
+            return events
+
+        # propagation skips collapsed cells, so adjacent pins are checked
+        # against each other here
+        for (i, j) in sorted(constraints.pins):
+            events += self.check_collapsed(i, j)
+            if self.contradiction is not None:
+                return events
+
+        changed = {(e.i, e.j) for e in events}
+        return events + self.propagate(
+            [self.cells[i * self.w + j] for i, j in sorted(changed)]
+        )
 
-                before = len(cells[n]["options"])
-                connectors = [tiles[opt].get_type(dir) for opt in curr["options"]]
-                options = [
-                    opt
-                    for opt in cells[n]["options"]
-                    if tiles[opt].get_type(opposite) in connectors
-                ]
+    def snapshot(self) -> Snapshot:
+        options = np.zeros((len(self.cells), len(self.names)), dtype=bool)
+        for n, c in enumerate(self.cells):
+            options[n, c["options"]] = True
 
-                cells[n]["options"] = options
-                if len(cells[n]["options"]) < before:
-                    stack.append(cells[n])
+        return Snapshot(
+            h=self.h,
+            w=self.w,
+            options=options,
+            collapsed=np.array([c["is_collapsed"] for c in self.cells]),
+            random=self.random.getstate(),
+        )
 
-                if use_information_entropy:
-                    cells[n]["entropy"] = entropy(cells[n])
-                else:
-                    cells[n]["entropy"] = len(cells[n]["options"])
+    def restore(self, snapshot: Snapshot):
+        if (snapshot.h, snapshot.w) != (self.h, self.w):
+            raise ValueError(
+                f"snapshot of a {snapshot.w}x{snapshot.h} grid, "
+                f"expected {self.w}x{self.h}"
+            )
+        if snapshot.options.shape[1] != len(self.names):
+            raise ValueError(
+                f"snapshot with {snapshot.options.shape[1]} tiles, "
+                f"expected {len(self.names)}"
+            )
 
-                if len(cells[n]["options"]) == 0:
-                    return True, ni, nj
+        self.remaining = 0
+        self.contradiction = None
+        for n, c in enumerate(self.cells):
+            c["options"] = np.flatnonzero(snapshot.options[n]).tolist()
+            c["is_collapsed"] = bool(snapshot.collapsed[n])
+            if c["is_collapsed"]:
+                c["entropy"] = 0
+            else:
+                c["entropy"] = self.entropy(c["options"])
+                self.remaining += 1
+                if len(c["options"]) == 0:
+                    self.contradiction = (c["i"], c["j"])
 
-    return False, None, None
+        self.random.setstate(snapshot.random)
+        self.min_entropy = None
 
 
 def wave_function_collapse(
@@ -304,6 +704,14 @@ def wave_function_collapse(
     use_information_entropy: bool,
     frame_rate: int = 30,
     interactive: bool = True,
+    show_minimap: bool = False,
+    step_budget: float | None = None,
+    seed: int | None = None,
+    checkpoint: Path | None = None,
+    checkpoint_every: int = CHECKPOINT_EVERY,
+    resume: Path | None = None,
+    constraints: Constraints | None = None,
+    analysis: TilesetAnalysis | None = None,
 ) -> (List[dict], bool, float):
     dt = None
     running = True
@@ -311,56 +719,114 @@ def wave_function_collapse(
 
     nb_retries = 0
     t = time_ns()
+    seeds = Random(seed)
 
     while not valid and running:
         nb_retries += 1
-        cells = [
-            {
-                "i": i,
-                "j": j,
-                "options": list(tiles.keys()),
-                "is_collapsed": False,
-                "entropy": None,
-            }
-            for i in range(h) for j in range(w)
-        ]
-
-        for i, c in enumerate(cells):
-            cells[i]["entropy"] = entropy(c) if use_information_entropy else len(c["options"])
+        solver = Solver(
+            table,
+            w,
+            h,
+            use_information_entropy,
+            seed=seeds.randrange(2**32),
+            analysis=analysis,
+        )
+        if resume is not None:
+            solver.restore(Snapshot.load(resume))
+            info(f"resuming from [purple]{resume}[/purple]")
+            resume = None
+        elif constraints is not None:
+            try:
+                solver.constrain(constraints)
+            except ValueError as e:
+                error(f"invalid constraints: {e}")
+                return solver.cells, running, dt
+            # no amount of retries would get past the constraints themselves
+            if solver.contradiction is not None:
+                ci, cj = solver.contradiction
+                error(f"constraints are inconsistent in cell ({ci}, {cj})")
+                return solver.cells, running, dt
+        cells = solver.cells
 
-        min_entropy = float("inf")
-        while running:
+        # the whole grid is drawn in the first frame, then only the cells which
+        # changed, or which are highlighted or not anymore
+        dirty, highlighted = None, set()
+        nb_steps = 0
+        while running and not solver.done:
             if interactive:
                 running, *_ = handle_events()
 
-            # pick non-collapsed cell with least entropy
-            non_collapsed = list(filter(lambda c: not c["is_collapsed"], cells))
-            # FIXME: should backtrack here instead of breaking out of the algorithm
-            if len(non_collapsed) == 0:
-                break
-            min_entropy = min(non_collapsed, key=lambda c: c["entropy"])["entropy"]
-            cell = choice(list(filter(
-                lambda c: c["entropy"] == min_entropy,
-                non_collapsed,
-            )))
-
-            is_inconsistent, ni, nj = collapse(cell, cells, w, h, use_information_entropy)
-            if is_inconsistent:
-                error(f"found an inconsistency in cell ({ni}, {nj})")
-                break
+            # collapse as many cells as fit in the time budget of the frame,
+            # at least one
+            changed = set()
+            start = time_ns()
+            while not solver.done:
+                for event in solver.step():
+                    changed.add(event.i * w + event.j)
+                    # FIXME: should backtrack here instead of breaking out of the algorithm
+                    if isinstance(event, Contradiction):
+                        error(f"found an inconsistency in cell ({event.i}, {event.j})")
+
+                nb_steps += 1
+                if checkpoint is not None and nb_steps % checkpoint_every == 0:
+                    solver.snapshot().save(checkpoint)
+
+                if (
+                    step_budget is None
+                    or time_ns() - start >= step_budget * 1_000_000
+                ):
+                    break
 
             if interactive:
-                show(cells, s, show_average_of_tile, min_entropy)
+                previous = highlighted
+                highlighted = {
+                    n
+                    for n, c in enumerate(cells)
+                    if not c["is_collapsed"] and c["entropy"] == solver.min_entropy
+                }
+                if dirty is not None:
+                    dirty = changed | previous | highlighted
+                show(
+                    cells,
+                    s,
+                    show_average_of_tile,
+                    solver.min_entropy,
+                    show_minimap,
+                    dirty,
+                )
+                dirty = set()
                 dt = clock.tick(frame_rate) / 1000
 
-        if len([c for c in cells if not c["is_collapsed"]]) == 0:
-            valid = True
+        valid = solver.solved
 
     warning(f"retries: {nb_retries}, t: {time_ns() - t}")
 
+    # either complete or interrupted by the user
+    if checkpoint is not None:
+        solver.snapshot().save(checkpoint)
+
     return cells, running, dt
 
 
+# the pixel-wise average of the tiles, from the pixels of their sheet decoded
+# once instead of the surface of each tile
+def average_tiles(tiles: List[Tile]) -> pygame.surface.Surface:
+    sheet = tiles[0].sheet
+    if any(t.sheet is not sheet for t in tiles):
+        return average_images([t.image for t in tiles])
+
+    ids = [t.id for t in tiles]
+    output = pygame.Surface(tiles[0].image.get_size())
+    pygame.surfarray.blit_array(
+        output,
+        (
+            sheet.stack[ids, ..., :3].sum(axis=0, dtype=int) // len(ids)
+        ).swapaxes(0, 1),
+    )
+
+    return output
+
+
 def average_images(images: List[pygame.surface.Surface]) -> pygame.surface.Surface:
     output = pygame.Surface(images[0].get_size())
 
@@ -374,6 +840,59 @@ def average_images(images: List[pygame.surface.Surface]) -> pygame.surface.Surfa
     return output
 
 
+# the tiles along an L-shaped route from `a` to `b`, first along the row of
+# `a` and then along the column of `b`, restricted to the ones with `edge`
+# towards the previous and next cells of the route, e.g. to lay a path
+def route_domains(
+    tiles: Dict[str, Tile], a: (int, int), b: (int, int), edge: str = "path"
+) -> Dict[Tuple[int, int], List[str]]:
+    (ai, aj), (bi, bj) = a, b
+    dj = 1 if bj >= aj else -1
+    di = 1 if bi >= ai else -1
+    route = [(ai, j) for j in range(aj, bj, dj)]
+    route += [(i, bj) for i in range(ai, bi + di, di)]
+
+    directions = {(-1, 0): 'n', (1, 0): 's', (0, -1): 'w', (0, 1): 'e'}
+    domains = {}
+    for k, (i, j) in enumerate(route):
+        around = [route[x] for x in (k - 1, k + 1) if 0 <= x < len(route)]
+        dirs = [directions[(ni - i, nj - j)] for ni, nj in around]
+        domains[(i, j)] = [
+            name
+            for name, tile in tiles.items()
+            if all(tile.get_type(d) == edge for d in dirs)
+        ]
+    return domains
+
+
+# the collapsed cells as a single layer of Tiled global tile ids
+def export_map(path: Path, cells: List[dict], w: int, h: int):
+    layer = np.zeros((h, w), dtype=np.uint32)
+    for c in cells:
+        if c["is_collapsed"] and len(c["options"]) > 0:
+            layer[c["i"], c["j"]] = table.ids[c["options"][0]] + FIRST_GID
+
+    sheet = table.tiles[0].sheet
+    try:
+        write_map(
+            path, {"background": layer}, sheet, chunk_size=EXPORT_CHUNK_SIZE
+        )
+    except Exception as e:
+        warning(f"map not saved in [purple]{path}[/purple]: {e}")
+        return
+    info(f"map saved in [purple]{path}[/purple]")
+
+
+def pin():
+    def type_func(val: str) -> ((int, int), str):
+        try:
+            i, j, tile = val.split(",")
+            return (int(i), int(j)), tile
+        except ValueError:
+            raise Exception(f"expected I,J,TILE, found {val}")
+    return type_func
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--map-width", "-W", type=int, required=True)
@@ -381,15 +900,69 @@ if __name__ == "__main__":
     parser.add_argument("--tile-size", "-s", type=int, required=True)
     parser.add_argument("--frame-rate", "-f", type=int, default=30)
     parser.add_argument("--show-average", "-a", action="store_true")
+    parser.add_argument("--minimap", "-m", action="store_true")
+    parser.add_argument(
+        "--step-budget",
+        "-b",
+        type=float,
+        help="time given to the solver in each frame, in ms, only one cell is "
+        "collapsed per frame by default",
+    )
     parser.add_argument("--non-interactive", "-I", action="store_true")
     parser.add_argument("--use-information-entropy", action="store_true")
     parser.add_argument("--analyze-algorithm", "-A", action="store_true")
     parser.add_argument("--nb-measurements", "-n", type=int, default=10)
+    parser.add_argument("--tileset", type=Path, default=Path("../../punyworld.json"))
+    parser.add_argument("--seed", type=int)
+    parser.add_argument(
+        "--checkpoint",
+        type=Path,
+        help="file where the state of the generation is saved regularly",
+    )
+    parser.add_argument(
+        "--checkpoint-every", type=int, default=CHECKPOINT_EVERY
+    )
+    parser.add_argument(
+        "--resume", type=Path, help="checkpoint to resume the generation from"
+    )
+    parser.add_argument(
+        "--pin",
+        type=pin(),
+        action="append",
+        default=[],
+        help="sets the tile of a cell before the generation, as I,J,TILE",
+    )
+    parser.add_argument(
+        "--border",
+        type=lambda val: val.split(","),
+        help="comma-separated tiles the edges of the map are restricted to",
+    )
+    parser.add_argument(
+        "--export",
+        type=Path,
+        help="file where generated maps are saved, as .tmj, .tmx or .pwm",
+    )
+    parser.add_argument(
+        "--path",
+        type=lambda val: tuple(map(int, val.split(","))),
+        help="lays a path between two cells, as I1,J1,I2,J2",
+    )
     args = parser.parse_args()
 
-    tiles, _, _ = load_tileset(Path("../../punyworld.json"))
+    tiles, _, _ = load_tileset(args.tileset)
     tiles = {k: tiles[k] for k, _ in TILE_SUBSET}
-    weights = {k: w for k, w in TILE_SUBSET}
+    table = TileTable(tiles, weights={k: w for k, w in TILE_SUBSET})
+
+    analysis = analyze_tileset(tiles)
+    for (d, edge), names in analysis.unreachable.items():
+        warning(f"no tile matches edge {edge} on side {d} of {names}")
+    if len(analysis.dead) > 0:
+        warning(f"{len(analysis.dead)} tiles can never be placed: {analysis.dead}")
+
+    constraints = Constraints(pins=dict(args.pin), border=args.border)
+    if args.path is not None:
+        i1, j1, i2, j2 = args.path
+        constraints.domains = route_domains(tiles, (i1, j1), (i2, j2))
 
     if args.analyze_algorithm:
         for _ in range(args.nb_measurements):
@@ -401,6 +974,8 @@ if __name__ == "__main__":
                 args.use_information_entropy,
                 frame_rate=args.frame_rate,
                 interactive=False,
+                constraints=constraints,
+                analysis=analysis,
             )
         exit(0)
 
@@ -417,14 +992,14 @@ if __name__ == "__main__":
     running = True
     rerun = False
     cells = []
+    screenshots = ScreenshotWriter(
+        on_saved=lambda out: info(f"window saved in [purple]{out}[/purple]")
+    )
 
     while running:
         running, rerun, snapshot = handle_events()
         if snapshot:
-            out = f"{time_ns()}.png"
-            image = np.transpose(pygame.surfarray.array3d(screen), (1, 0, 2))
-            Image.fromarray(image).save(out)
-            info(f"window saved in [purple]{out}[/purple]")
+            screenshots.save(screen, f"{time_ns()}.png")
         if rerun:
             cells, running, dt = wave_function_collapse(
                 args.map_width,
@@ -434,8 +1009,26 @@ if __name__ == "__main__":
                 args.use_information_entropy,
                 frame_rate=args.frame_rate,
                 interactive=not args.non_interactive,
+                show_minimap=args.minimap,
+                step_budget=args.step_budget,
+                seed=args.seed,
+                checkpoint=args.checkpoint,
+                checkpoint_every=args.checkpoint_every,
+                resume=args.resume,
+                constraints=constraints,
+                analysis=analysis,
             )
-        show(cells, args.tile_size, args.show_average, min_entropy=None)
+            args.resume = None
+            if args.export is not None:
+                export_map(args.export, cells, args.map_width, args.map_height)
+        show(
+            cells,
+            args.tile_size,
+            args.show_average,
+            min_entropy=None,
+            show_minimap=args.minimap,
+        )
         dt = clock.tick(args.frame_rate) / 1000
 
     pygame.quit()
+    screenshots.close()